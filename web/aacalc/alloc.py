@@ -0,0 +1,1712 @@
+# AACalc - Asset Allocation Calculator
+# Copyright (C) 2009, 2011-2017 Gordon Irlam
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Asset allocation engine. Does not depend on Django, so it can be used by batch scripts and worker processes.
+# Market data is loaded the first time it is needed.
+
+from copy import copy
+from csv import reader
+from datetime import datetime, timedelta
+from decimal import Decimal
+from math import ceil, exp, isnan, log, sqrt
+
+from numpy import add, arange, argmax, array, copysign, divide, errstate, floor, full, isfinite, maximum, minimum, newaxis, power, trunc, where, zeros
+from numpy import exp as array_exp, isnan as array_isnan, log as array_log, sqrt as array_sqrt
+from numpy.linalg import inv, LinAlgError
+from os.path import expanduser, isdir, join, normpath
+from scipy.optimize import brentq
+from scipy.special import ndtri
+
+from aacalc.spia import LifeTable, Scenario, YieldCurve, get_yield_curve
+
+datapath = ('~/aacalc/opal/data/public', '~ubuntu/aacalc/opal/data/public')
+
+hecm_plf_file = 'august2017plftables.csv'  # HECM principal limit factor table to use, in the hecm data directory.
+
+mwr = 0.96
+    # In 2014, observed real MWRs were around 100% range for ages 40-80. At age 85 it was 9% lower when using aer2005-08-summary.
+    # In 2017, with AIG no longer being in the market we estimate MWRs are now perhaps 4% lower.
+    # No adjustment for state taxes, but we impose a minimum required total portfolio gain of 4% later.
+
+# Deleterious stock market returns are fat-tailed.
+# For 1927-2014 we empirically observed the 10th percentile stock return corresponding to the 6th percentile of the lognormal distribution.
+loss_pctl = 0.1
+loss_pctl_fat_tail = 0.06
+# Deleterious bond market returns appear, if anything, the opposite of fat-tailed.
+# We could try to weight this in, but don't. It is acceptable to over-report the odds of deleterious outcomes.
+
+annuitization_delay_cost = (0.0, 0.0, 0.0, 0.013, 0.018, 0.029, 0.049, 0.093, 0.221, 0.391)
+    # Cost of delaying anuitization by 10 years, every 10 years of age.
+    # Birth year = 2015 - starting age.
+
+# Next two parameters determined to give good results empirically
+# using stochastic dynamic programming as the reference. Don't know
+# any other good way to approach the problem.
+consume_pctl = 97
+    # Percentile age up to which to use in computing amount to
+    # consume.
+growth_pctl_no_db = 43
+    # Percentile location of fixed rate of return to use in computing
+    # amount to consume in absence of defined benefits.
+
+retirement_curve_span = 5
+    # Report consumption for retirement ages up to this many years either side of the baseline retirement age.
+
+# No enums until Python 3.4.
+stocks_index = 0
+bonds_index = 1
+risk_free_index = 2
+contrib_index = 3
+existing_annuities_index = 4
+new_annuities_index = 5
+home_equity_index = 6
+num_index = 7
+
+class Alloc:
+
+    class IdenticalCovarError(Exception):
+        pass
+
+    class RMTooYoung(Exception):
+        pass
+
+    def default_alloc_params(self):
+
+        return {
+            'sex': 'male',
+            'age': 50,
+            'sex2': 'none',
+            'age2': None,
+            'le_set': None,
+            'le_set2': None,
+
+            'db' : ({
+                'social_security': True,
+                'description': '',
+                'who': 'self',
+                'age': 66,
+                'amount': 15000,
+                'inflation_indexed': True,
+                'period_certain': 0,
+                'joint_type': 'survivor',
+                'joint_payout_pct': 0,
+            }, {
+                'social_security': True,
+                'description': '',
+                'who': 'spouse',
+                'age': 66,
+                'amount': 0,
+                'inflation_indexed': True,
+                'period_certain': 0,
+                'joint_type': 'survivor',
+                'joint_payout_pct': 0,
+            }, {
+                'social_security': False,
+                'description': 'Pension',
+                'who': 'self',
+                'age': 66,
+                'amount': 0,
+                'inflation_indexed': True,
+                'period_certain': 0,
+                'joint_type': 'survivor',
+                'joint_payout_pct': 0,
+            }, {
+                'social_security': False,
+                'description': 'Pension',
+                'who': 'self',
+                'age': 66,
+                'amount': 0,
+                'inflation_indexed': True,
+                'period_certain': 0,
+                'joint_type': 'survivor',
+                'joint_payout_pct': 0,
+            }, {
+                'social_security': False,
+                'description': 'Pension',
+                'who': 'spouse',
+                'age': 66,
+                'amount': 0,
+                'inflation_indexed': True,
+                'period_certain': 0,
+                'joint_type': 'survivor',
+                'joint_payout_pct': 0,
+            }, {
+                'social_security': False,
+                'description': 'Pension',
+                'who': 'spouse',
+                'age': 66,
+                'amount': 0,
+                'inflation_indexed': True,
+                'period_certain': 0,
+                'joint_type': 'survivor',
+                'joint_payout_pct': 0,
+            }, {
+                'social_security': False,
+                'description': 'Income annuity',
+                'who': 'self',
+                'age': 66,
+                'amount': 0,
+                'inflation_indexed': True,
+                'period_certain': 0,
+                'joint_type': 'contingent',
+                'joint_payout_pct': 70,
+            }, {
+                'social_security': False,
+                'description': 'Income annuity',
+                'who': 'self',
+                'age': 66,
+                'amount': 0,
+                'inflation_indexed': False,
+                'period_certain': 0,
+                'joint_type': 'contingent',
+                'joint_payout_pct': 70,
+            }, {
+                'social_security': False,
+                'description': 'Income annuity',
+                'who': 'spouse',
+                'age': 66,
+                'amount': 0,
+                'inflation_indexed': True,
+                'period_certain': 0,
+                'joint_type': 'contingent',
+                'joint_payout_pct': 70,
+            }, {
+                'social_security': False,
+                'description': 'Income annuity',
+                'who': 'spouse',
+                'age': 66,
+                'amount': 0,
+                'inflation_indexed': False,
+                'period_certain': 0,
+                'joint_type': 'contingent',
+                'joint_payout_pct': 70,
+            }, {
+                'social_security': False,
+                'description': 'Reverse mortgage',
+                'who': 'self',
+                'age': 62,
+                'amount': 0,
+                'inflation_indexed': False,
+                'period_certain': 0,
+                'joint_type': 'contingent',
+                'joint_payout_pct': 100,
+            }),
+            'p_traditional_iras': 0,
+            'tax_rate_pct': 30,
+            'p_roth_iras': 0,
+            'p': 0,
+            'contribution': 2000,
+            'contribution_reduction': 0,
+            'mortgage_payment': 0,
+            'contribution_growth_pct': Decimal('5.0'),
+            'contribution_vol_pct': Decimal('20.0'),
+            'home': 0,
+            'home_ret_pct': Decimal('1.0'),
+            'home_vol_pct': Decimal('5.0'),
+            'mortgage': 0,
+            'mortgage_rate_pct': Decimal('5.0'),
+            'have_rm': False,
+            'rm_loc': 0,
+
+            'retirement_age': 66,
+            'retirement_age2': None,
+            'joint_income_pct': 70,
+            'needed_income': None,
+            'desired_income': None,
+            'required_income': 20000,
+            'purchase_income_annuity': True,
+            'use_lm_bonds': True,
+            'use_rm': True,
+            'rm_plf': None,
+            'rm_interest_rate_premium_pct': Decimal('0.60'),
+            'rm_delay': None,
+            'rm_interest_rate_pct': None,
+            'rm_cost': 10000,
+            'rm_age': 62,
+            'rm_tenure_limit': 100,
+            'rm_tenure_duration': 5,
+            'rm_eligible': 625500,
+
+            'equity_ret_pct': Decimal('7.2'),
+            'equity_vol_pct': Decimal('17.0'),
+            'bonds_premium_pct': Decimal('0.6'),
+            'bonds_vol_pct': Decimal('8.7'),
+            'inflation_pct': Decimal('2.3'),
+            'equity_bonds_corr_pct': Decimal('7.3'),
+            'real_vol_10yr_pct': Decimal('4.8'),
+            'bonds_lm_bonds_corr_short_pct': Decimal('23.9'),
+            'equity_se_pct': Decimal('1.7'),
+            'confidence_pct': 80,
+            'expense_pct': Decimal('0.1'),
+            'rm_margin_pct': Decimal('2.50'),
+            'rm_insurance_initial_pct': Decimal('2.00'),
+            'rm_insurance_annual_pct': Decimal('0.50'),
+            'date': (datetime.utcnow() + timedelta(hours = -24)).date().isoformat(),  # Yesterday's quotes are retrieved at midnight.
+            'real_rate_pct': None,
+
+            'gamma': Decimal('3.0'),
+            'risk_tolerance_pct': Decimal('20.0'),
+        }
+
+    def distribution_pctl(self, pctl, mean, vol):
+        # Convert mean and vol to lognormal distribution mu and sigma parameters.
+        try:
+            mu = log(mean ** 2 / sqrt(vol ** 2 + mean ** 2))
+        except ZeroDivisionError:
+            return mean
+        sigma = sqrt(log(vol ** 2 / mean ** 2 + 1))
+        scale = exp(mu)
+        if not (sigma > 0 and scale > 0):
+            # vol == 0.
+            return mean
+        # Computed in the same way as lognorm.ppf(pctl, sigma, scale=scale), but without the scipy.stats per call overhead.
+        value = exp(sigma * normal_ppf(pctl)) * scale
+        if isnan(value):
+            return mean
+        return value
+
+    def distribution_pctls(self, pctl, means, vols):
+        # Vectorized distribution_pctl() for arrays of means and vols.
+        # Square using power() rather than ** so results match the scalar computation; numpy evaluates array ** 2 as array * array.
+        means_squared = power(means, 2)
+        vols_squared = power(vols, 2)
+        with errstate(divide = 'ignore', invalid = 'ignore', over = 'ignore'):
+            mus = array_log(means_squared / array_sqrt(vols_squared + means_squared))
+            sigmas = array_sqrt(array_log(vols_squared / means_squared + 1))
+            scales = array_exp(mus)
+            values = array_exp(sigmas * normal_ppf(pctl)) * scales
+            valid = (means != 0) & (sigmas > 0) & (scales > 0) & ~ array_isnan(values)
+        return where(valid, values, means)
+
+    def geomean(self, mean, vol):
+        return self.distribution_pctl(0.5, mean, vol)
+
+    def solve_merton(self, gamma, sigma_matrix, alpha, r):
+        try:
+            w = inv(sigma_matrix).dot(array(alpha) - r) / gamma
+        except LinAlgError:
+            raise self.IdenticalCovarError
+        return tuple(float(wi) for wi in w) # De-numpyfy.
+
+    def exhaustive_search_points(self, a, b, step):
+        # The points from a to b, step apart, that are searched for a maximum, in order, with b always included.
+        # Taking argmax() of the values at these points gives the first, and hence lowest, point at which the maximum occurs.
+
+        points = []
+
+        x = a
+
+        while not points or x < b:
+            points.append(x)
+            x += step
+
+        points.append(b)
+
+        return points
+
+    def gss(self, f, a, b, tol):
+
+        f_a = f(a)
+        f_b = f(b)
+
+        # Golden segment search for maximum of f on [a, b].
+        g = (1 + sqrt(5)) / 2
+        while (b - a) >= tol:
+            c = b - (b - a) / g
+            d = a + (b - a) / g
+            f_c = f(c)
+            f_d = f(d)
+            if f_c >= f_d:
+                b = d
+                f_b = f_d
+            else:
+                a = c
+                f_a = f_c
+        if f_a >= f_b:
+            found = a
+            f_found = f_a
+        else:
+            found = b
+            f_found = f_b
+
+        return found, f_found
+
+    def schedule_range(self, val, min_years = 0, max_years = float('inf')):
+
+        def sched(y):
+            if min_years <= y < max_years:
+                return val ** y
+            else:
+                return 0
+
+        return sched
+
+    def npv_contrib(self):
+
+        payout_delay = 0
+
+        schedule = self.schedule_range(1 + self.contribution_growth)
+
+        # Restrict size of life table rather than using period_certain for speed.
+        life_table = LifeTable('live', 'male', 0, death_age = self.pre_retirement_years)
+
+        scenario = Scenario(self.yield_curve_nominal, payout_delay, None, None, 0, life_table,
+            frequency = 1, schedule = schedule)
+        value1 = self.mortgage_payment * scenario.price()
+        annual_ret1 = scenario.annual_return - self.inflation
+
+        # Assume both spouses make it to retirement.
+
+        scenario = Scenario(self.yield_curve_real, payout_delay, None, None, 0, life_table,
+            frequency = 1, cpi_adjust = 'all', schedule = schedule)
+        value2 = (self.contribution - self.contribution_reduction) * scenario.price()
+        annual_ret2 = scenario.annual_return
+
+        life_table = LifeTable('live', 'male', 0, death_age = self.pre_retirement_years_full_contrib)
+
+        scenario = Scenario(self.yield_curve_real, payout_delay, None, None, 0, life_table,
+            frequency = 1, cpi_adjust = 'all', schedule = schedule)
+        value3 = self.contribution_reduction * scenario.price()
+        annual_ret3 = scenario.annual_return
+
+        value = value1 + value2 + value3
+        try:
+            annual_ret = (value1 * annual_ret1 + value2 * annual_ret2 + value3 * annual_ret3) / value
+        except ZeroDivisionError:
+            annual_ret = 0
+
+        return value, annual_ret
+
+    def value_table_db(self):
+
+        table_db = []
+        nv_db = 0
+
+        for db in self.db:
+
+            amount = float(db['amount'])
+
+            if amount == 0:
+                continue
+
+            yield_curve = self.yield_curve_real if db['inflation_indexed'] else self.yield_curve_nominal
+
+            if db['who'] == 'self':
+                starting_age = self.age
+                lt1 = self.life_table
+                lt2 = self.life_table2
+            else:
+                starting_age = self.age2
+                lt1 = self.life_table2
+                lt2 = self.life_table
+
+            delay = float(db['age']) - starting_age
+            positive_delay = max(0, delay)
+            negative_delay = min(0, delay)
+            payout_delay = positive_delay * 12
+            period_certain = max(0, self.pre_retirement_years - positive_delay, float(db['period_certain']) + negative_delay)
+                # For planning purposes when computing the npv of defined benefits and contributions we need to assume we will reach retirement.
+
+            joint_payout_fraction = float(db['joint_payout_pct']) / 100
+            joint_contingent = (db['joint_type'] == 'contingent')
+
+            scenario = Scenario(yield_curve, payout_delay, None, None, 0, lt1, life_table2 = lt2, \
+                joint_payout_fraction = joint_payout_fraction, joint_contingent = joint_contingent, \
+                period_certain = period_certain, frequency = self.frequency, cpi_adjust = self.cpi_adjust)
+            price = scenario.price() * amount
+            nv_db += price
+
+            table_db.append({
+                'description': db['description'] if db['description'] else 'Social Security',
+                'who': db['who'],
+                'nv': '{:,.0f}'.format(price),
+            })
+
+        return table_db, nv_db
+
+    def yield_curve_nominal_average_discount_rates(self, maturities):
+        # Vectorized lookup_yield_curve_nominal_average().
+
+        if self.real_rate == None:
+            return get_yield_curve_nominal_average().discount_rates(maturities)
+        else:
+            return self.yield_curve_nominal.discount_rates(maturities)
+
+    def lookup_yield_curve_nominal_average(self, maturity):
+
+        try:
+            return self.yield_curve_nominal_average_cache[maturity]
+        except KeyError:
+            if self.real_rate == None:
+                discount_rate = get_yield_curve_nominal_average().discount_rate(maturity)
+            else:
+                discount_rate = self.yield_curve_nominal.discount_rate(maturity)
+            self.yield_curve_nominal_average_cache[maturity] = discount_rate
+            return discount_rate
+
+    def value_table(self, nv_db, taxable):
+
+        results = {}
+        display = {}
+
+        nv_traditional = self.traditional * (1 - self.tax_rate)
+        nv_investments = nv_traditional + self.npv_roth + taxable
+
+        try:
+            mortgage_payoff_years = 0 - log(1 - self.mortgage * self.mortgage_rate / self.mortgage_payment) / log(1 + self.mortgage_rate)
+                # If simply negate, get "-0" when log ... == 0.
+        except ZeroDivisionError:
+            mortgage_payoff_years = 0 if self.mortgage == 0 else float('inf')
+        except ValueError:
+            mortgage_payoff_years = float('inf')
+
+        payout_delay = 0
+
+        schedule = self.schedule_range(1, 0, mortgage_payoff_years)
+
+        scenario = Scenario(self.yield_curve_nominal, payout_delay, None, None, 0, self.life_table, life_table2 = self.life_table2, \
+            joint_payout_fraction = 1, joint_contingent = True,
+            period_certain = 0, frequency = self.frequency, schedule = schedule)
+        nv_mortgage = scenario.price() * self.mortgage_payment
+
+        scenario = Scenario(self.yield_curve_nominal, payout_delay, None, None, 0, self.life_table, life_table2 = self.life_table2, \
+            period_certain = mortgage_payoff_years, frequency = self.frequency, schedule = schedule)
+        nv_mortgage_payoff = scenario.price() * self.mortgage_payment
+
+        # HECM rates are not APR.
+        increase_rate = 1 + (self.rm_margin + self.rm_insurance_annual + self.lookup_yield_curve_nominal_average(1) - 1 + self.rm_interest_rate_premium) / 12
+        increase_rate_annual = increase_rate ** 12
+
+        nominal_scenario = Scenario(self.yield_curve_nominal, 0, None, None, 0, self.life_table, life_table2 = self.life_table2, \
+            joint_payout_fraction = 1, joint_contingent = True,
+            period_certain = self.pre_retirement_years, frequency = 12)
+        nominal_scenario.price(calcs = True)
+
+        def npv_credit_factors(delays, credit_line_delays):
+            # Net present value of a credit line of one dollar taken out after delay years and held for a further credit_line_delay years.
+            # Computed for broadcast arrays of delays and credit line delays. Zero if beyond the end of life.
+
+            total_delays = delays + credit_line_delays
+            fair_prices = nominal_scenario.calcs.fair_price
+            indexes = round_half_away(total_delays * 12).astype(int)
+            in_range = indexes < len(fair_prices)
+            fair_price = where(in_range, fair_prices[where(in_range, indexes, 0)], 0)
+            increase_factor = (self.yield_curve_nominal.discount_rates(total_delays) / self.yield_curve_nominal_average_discount_rates(total_delays)) \
+                              ** total_delays \
+                              / (self.yield_curve_nominal.discount_rates(delays) / self.yield_curve_nominal_average_discount_rates(delays)) ** delays \
+                              * increase_rate_annual ** credit_line_delays
+            nv_credit_factors = where(in_range, fair_price * increase_factor, 0)
+
+            return nv_credit_factors
+
+        def best_credit_factors(delays):
+            # For each delay, search the credit line delays 0, 1, ... up to the end of life for the best credit factor, preferring the
+            # earliest credit line delay on ties, as argmax() does. The credit factors are computed as a single 2-D array over delay and
+            # credit line delay, and the end of life is then checked separately. Returns arrays of the best credit line delays and
+            # credit factors.
+
+            delays = array(delays, dtype = float)
+            ends = 120 - delays - self.min_age
+            credit_line_delays = arange(max(1, int(ceil(ends.max()))), dtype = float)
+            factors = npv_credit_factors(delays[:, newaxis], credit_line_delays[newaxis, :])
+            searched = (credit_line_delays[newaxis, :] < ends[:, newaxis]) | (credit_line_delays[newaxis, :] == 0)
+            factors = where(searched, factors, float('-inf'))
+            end_factors = npv_credit_factors(delays, ends)
+
+            best = argmax(factors, axis = 1)
+            best_factors = factors[arange(len(delays)), best]
+            end_best = end_factors > best_factors
+            best_credit_line_delays = where(end_best, ends, credit_line_delays[best])
+            best_factors = where(end_best, end_factors, best_factors)
+
+            return best_credit_line_delays, best_factors
+
+        if self.have_rm:
+
+            mortgage_payoff = nv_mortgage
+            delay = 0
+            credit_line = self.rm_loc
+            credit_line_delays, factors = best_credit_factors((delay, ))
+            credit_line_delay = float(credit_line_delays[0])
+            factor = float(factors[0])  # De-numpyfy.
+            nv_credit_line = factor * self.rm_loc
+            delay_tenure = 0
+            tenure = 0
+            nv_tenure = 0
+
+        else:
+
+            try:
+                mortgage_payoff = self.mortgage * min(self.nv_contributions / nv_mortgage_payoff, 1)
+            except ZeroDivisionError:
+                mortgage_payoff = 0
+
+            credit_line_cache = {}
+
+            def lookup_credit_lines(plf_ages):
+                # Look up the credit line available at each of the plf_ages.
+                # Returns arrays of the delays, expected rates, credit lines, and credit line vols.
+                # Results are cached by plf_age so that the credit line and tenure searches share lookups.
+
+                missing = tuple(set(plf_age for plf_age in plf_ages if plf_age not in credit_line_cache))
+                if missing:
+
+                    delays = array(missing) - self.min_age
+                    if self.rm_interest_rate == None:
+                        maturity = 10
+                        initial = self.yield_curve_nominal.discount_rates(delays) ** delays
+                        final = self.yield_curve_nominal.discount_rates(delays + maturity) ** (delays + maturity)
+                        interest_rates = (final / initial) ** (1.0 / maturity) - 1
+                    else:
+                        interest_rates = full(len(missing), self.rm_interest_rate)
+                    expected_rates = interest_rates + self.rm_margin
+                    if self.rm_plf == None:
+                        plfs = get_hecm_plf().lookup(array(missing), expected_rates * 100)
+                    else:
+                        plfs = full(len(missing), self.rm_plf)
+
+                    factors = plfs - self.rm_insurance_initial
+                    home_value_factors = ((1 + self.home_ret) * (1 + self.inflation)) ** delays
+                    home_values = home_value_factors * self.home
+                    credit_lines = factors * minimum(home_values, self.rm_eligible) - self.rm_cost - (self.mortgage - mortgage_payoff)
+                    credit_lines = where((plfs != 0) & (credit_lines > 0), credit_lines, 0)
+                    credit_line_vols = where((plfs != 0) & (home_values < self.rm_eligible), factors * home_values * self.home_vol, 0)
+
+                    for plf_age, delay, expected_rate, credit_line, credit_line_vol in \
+                        zip(missing, delays, expected_rates, credit_lines, credit_line_vols):
+                        credit_line_cache[plf_age] = (float(delay), float(expected_rate), float(credit_line), float(credit_line_vol))  # De-numpyfy.
+
+                return tuple(array(values) for values in zip(*(credit_line_cache[plf_age] for plf_age in plf_ages)))
+
+            def f(plf_ages):
+                # Evaluate each of the plf_ages, returning a list of the results for each.
+
+                delays, expected_rates, credit_lines, credit_line_vols = lookup_credit_lines(plf_ages)
+                credit_line_delays, factors = best_credit_factors(delays)
+                results = []
+                for delay, expected_rate, credit_line, credit_line_vol, credit_line_delay, factor in \
+                    zip(delays.tolist(), expected_rates.tolist(), credit_lines.tolist(), credit_line_vols.tolist(), credit_line_delays.tolist(), factors.tolist()):
+                    nv_credit_line = factor * credit_line
+                    credit_line_vol *= factor
+                    results.append((nv_credit_line, delay, credit_line_delay, expected_rate, credit_line, credit_line_vol))
+
+                return results
+
+            if self.rm_delay == None:
+                plf_age_start = self.min_age + max(0, ceil(self.rm_age - self.min_age))
+                results_plf_ages = f(self.exhaustive_search_points(plf_age_start, 120, 1))
+                nv_credit_lines = tuple(nv_credit_line for nv_credit_line, _, _, _, _, _ in results_plf_ages)
+                nv_credit_line, delay, credit_line_delay, expected_rate, credit_line, credit_line_vol = results_plf_ages[argmax(nv_credit_lines)]
+            else:
+                plf_age = self.min_age + self.rm_delay
+                if plf_age < self.rm_age:
+                    raise self.RMTooYoung
+                nv_credit_line, delay, credit_line_delay, expected_rate, credit_line, credit_line_vol = f((plf_age, ))[0]
+
+            compounding_rate = (expected_rate + self.rm_insurance_annual) / 12
+                # The HUD docs say to add the "monthly MIP (0.5 percent)" rate above, but the ongoing monthly MIP rate is 1.25%, not 0.5%.
+                # http://www.myhecm.com/hecm-calculator-step-1-n might use 0.5%
+                # https://retirementresearcher.com/reverse-mortgage-calculator/ uses 1.25%.
+                # http://www.reversemortgage.org/About/Reverse-Mortgage-Calculator uses 1.25%.
+                # And rm_insurance_annual defaults to 1.25%.
+            compounding = 1 + compounding_rate
+
+            tenure = 0
+            nv_tenure = 0
+            rm_delay = 0 if self.rm_delay == None else self.rm_delay
+            plf_age_start = max(self.min_age + rm_delay, self.rm_age)
+            delay_tenure = plf_age_start - self.min_age
+
+            # Consider each possible start age, working backwards month by month from the end of life. The discounted sum of the tenure
+            # payments, and the credit factor, for each start age are running sums, computed here as cumulative sums over monthly arrays.
+            plf_ages_monthly = arange(int(round(self.min_age * 12)) + len(nominal_scenario.calcs) - 1, int(ceil(plf_age_start * 12)) - 1, -1)
+            plf_ages = plf_ages_monthly / 12.0
+            initial_months = int(self.rm_tenure_duration * 12) + 1
+            compounded_months = (plf_ages < self.rm_tenure_limit - self.rm_tenure_duration).cumsum()
+            compounding_factors = full(initial_months + len(plf_ages), compounding)
+            compounding_factors[0] = 1
+            discounted_sums = add.accumulate(divide.accumulate(compounding_factors))
+            start_months = plf_ages_monthly % 12 == 0
+            if start_months.any():
+
+                discounted_sums_annual = discounted_sums[initial_months - 1 + compounded_months[start_months]] / 12.0
+                try_delays, try_expected_rates, try_credit_lines, try_credit_line_vols = lookup_credit_lines(plf_ages[start_months].tolist())
+                try_tenures = try_credit_lines / discounted_sums_annual
+                try_tenure_vols = try_credit_line_vols / discounted_sums_annual
+                try_nv_tenure_factors = add.accumulate(npv_credit_factors(try_delays, 0))
+                try_nv_tenures = try_nv_tenure_factors * try_tenures
+                try_tenure_vols *= try_nv_tenure_factors
+
+                best = argmax(try_nv_tenures)
+                if try_nv_tenures[best] > nv_tenure:
+                    delay_tenure = float(try_delays[best])
+                    tenure = float(try_tenures[best])
+                    tenure_vol = float(try_tenure_vols[best])
+                    nv_tenure = float(try_nv_tenures[best])  # De-numpyfy.
+
+        if delay == 0:
+            credit_line_vol = 0
+        if delay_tenure == 0:
+            tenure_vol = 0
+        rm_purchase_age = self.age + delay
+        credit_line_age = self.age + delay + credit_line_delay
+        tenure_age = self.age + delay_tenure
+
+        nv = nv_db + nv_investments + self.nv_contributions
+
+        rm_credit_line = nv_credit_line > nv_tenure
+        nv_available_home = 0 - nv_mortgage # If simply negate, get "-0" when mortgage == 0.
+        nv_utilized_home = nv_available_home
+        home_equity_vol = 0
+        if self.use_rm and max(nv_tenure, nv_credit_line) > 0:
+            rm_tenure = nv_tenure > nv_credit_line
+            if rm_tenure:
+                nv_rm = nv_tenure
+                nv_rm_vol = tenure_vol
+            else:
+                nv_rm = nv_credit_line
+                nv_rm_vol = credit_line_vol
+            nv_rm -= mortgage_payoff
+            nv_rm_vol /= nv_rm
+            using_reverse_mortgage = self.have_rm or nv_rm - nv_available_home > 10 / (100.0 - 10) * nv
+            nv_available_home = nv_rm
+            if using_reverse_mortgage:
+                nv_utilized_home = nv_rm
+                home_equity_vol = nv_rm_vol
+        else:
+            using_reverse_mortgage = False
+            rm_tenure = False
+
+        nv += nv_utilized_home
+
+        results['nv_db'] = nv_db
+        results['nv_mortgage_payoff'] = nv_mortgage_payoff
+        results['nv_available_home'] = nv_available_home
+        results['nv_utilized_home'] = nv_utilized_home
+        results['nv'] = nv
+        results['credit_line_age'] = credit_line_age
+        results['using_reverse_mortgage'] = using_reverse_mortgage
+        results['rm_tenure'] = rm_tenure
+        results['home_equity_vol'] = home_equity_vol
+
+        display['nv_db'] = '{:,.0f}'.format(nv_db)
+        display['nv_traditional'] = '{:,.0f}'.format(nv_traditional)
+        display['nv_roth'] = '{:,.0f}'.format(self.npv_roth)
+        display['nv_taxable'] = '{:,.0f}'.format(taxable)
+        display['nv_investments'] = '{:,.0f}'.format(nv_investments)
+        display['nv_home'] = '{:,.0f}'.format(self.home)
+        display['nv_mortgage'] = '{:,.0f}'.format(0 - nv_mortgage) # If simply negate, get "-0" when mortgage == 0.
+        display['nv_mortgage_payoff'] = '{:,.0f}'.format(nv_mortgage_payoff)
+        display['mortgage_payoff_years'] = '{:.0f}'.format(mortgage_payoff_years)
+        display['credit_line'] = '{:,.0f}'.format(credit_line)
+        display['nv_credit_line'] = '{:,.0f}'.format(nv_credit_line)
+        display['credit_line_age'] = '{:.0f}'.format(credit_line_age)
+        display['tenure'] = '{:,.0f}'.format(tenure)
+        display['nv_tenure'] = '{:,.0f}'.format(nv_tenure)
+        display['tenure_age'] = '{:.0f}'.format(tenure_age)
+        display['nv_available_home'] = '{:,.0f}'.format(nv_available_home)
+        display['nv_utilized_home'] = '{:,.0f}'.format(nv_utilized_home)
+        display['nv_contributions'] = '{:,.0f}'.format(self.nv_contributions)
+        display['nv'] = '{:,.0f}'.format(nv)
+        display['using_reverse_mortgage'] = using_reverse_mortgage
+        display['rm_tenure'] = rm_tenure
+        display['rm_purchase_age'] = '{:.0f}'.format(rm_purchase_age)
+
+        return results, display
+
+    def ret_vol(self, w, rets, bonds_vol, lm_bonds_vol, cov_bl2):
+        # Arithmetic return and volatility of the portfolio w.
+
+        total_ret = w[contrib_index] * rets[contrib_index] + w[stocks_index] * rets[stocks_index] + w[bonds_index] * rets[bonds_index] + \
+            w[risk_free_index] * rets[risk_free_index] + w[existing_annuities_index] * rets[existing_annuities_index] + \
+            w[new_annuities_index] * rets[new_annuities_index] + w[home_equity_index] * rets[home_equity_index]
+
+        total_var = w[contrib_index] ** 2 * self.contribution_vol ** 2 + \
+            w[stocks_index] ** 2 * self.equity_vol ** 2 + \
+            w[bonds_index] ** 2 * bonds_vol ** 2 + \
+            w[risk_free_index] ** 2 * lm_bonds_vol ** 2 + \
+            w[home_equity_index] ** 2 * self.home_equity_vol ** 2 + \
+            2 * w[stocks_index] * w[bonds_index] * self.cov_eb2 + \
+            2 * w[bonds_index] * w[risk_free_index] * cov_bl2
+            # contribution, risk_free, and home_equity covariances assumed zero against other asset classes.
+        total_vol = sqrt(total_var)
+
+        return total_ret, total_vol
+
+    def statistics(self, w, rets, bonds_vol, lm_bonds_vol, cov_bl2):
+
+        total_ret, total_vol = self.ret_vol(w, rets, bonds_vol, lm_bonds_vol, cov_bl2)
+        total_geometric_ret = self.geomean(1 + total_ret, total_vol) - 1
+
+        return total_ret, total_vol, total_geometric_ret
+
+    def portfolio_statistics(self, w, rets):
+
+        return self.statistics(w, rets, self.bonds_vol, self.lm_bonds_vol, self.cov_bl2)
+
+    def drop_weights(self, w, indices):
+
+        w = list(w)
+        for i in indices:
+            w[i] = 0
+        s = sum(w)
+        try:
+            return list(wi / float(s) for wi in w)
+        except:
+            return [0] * len(w)
+
+    def investment_ret_vol(self, w, rets):
+
+        w_investments = self.drop_weights(w, [contrib_index, home_equity_index, existing_annuities_index, new_annuities_index])
+
+        return self.ret_vol(w_investments, rets, self.bonds_vol_short, self.lm_bonds_vol_short, self.cov_bl2_short)
+
+    def investment_statistics(self, w, rets):
+
+        investments_ret, investments_vol = self.investment_ret_vol(w, rets)
+        investments_geometric_ret = self.geomean(1 + investments_ret, investments_vol) - 1
+
+        return investments_ret, investments_vol, investments_geometric_ret
+
+    def consume_factor(self, ret):
+
+        # We should use total_var, total_vol, and gamma to compute the
+        # annual consumption amount.  Merton's Continuous Time Finance
+        # provides solutions for a single risky asset with a finite
+        # time horizon, and many asset with a infinite time horizon,
+        # but not many assets with a finite time horizon. And even if
+        # such a solution existed we would also need to factor in
+        # pre-retirement years.
+
+        # We compute the withdrawal amount for a fixed compounding
+        # total portfolio.
+        # Equivalent to pricing consume_profile()'s scenario with a schedule of 1 / (1 + ret) ** y, as only the schedule varies.
+        payout_fraction, y, discount = self.consume_payouts
+        payout_value = payout_fraction * power(1 / (1.0 + ret), y) / discount
+        return float(payout_value.sum()) / self.frequency
+
+    def consume_profile(self):
+        # Survival weighted payouts and discount factors through the consume_pctl life expectancy, for consume_factor().
+
+        payout_delay = self.pre_retirement_years * 12
+        scenario = Scenario(self.yield_curve_zero, payout_delay, None, None, 0, self.life_table, life_table2 = self.life_table2, \
+            joint_payout_fraction = self.joint_payout_fraction, joint_contingent = True, \
+            period_certain = 0, frequency = self.frequency, cpi_adjust = self.cpi_adjust, percentile = consume_pctl)
+        grid = scenario.payout_grid()
+        _, _, _, _, calcs = scenario.payouts_from_grid(grid, consume_pctl, calcs = True)
+        return calcs.payout_fraction, calcs.y, grid['discount'][:len(calcs)]
+
+    def calc_consume(self, w, nv, ret, vol, results):
+
+        alloc_db = w[existing_annuities_index] + w[new_annuities_index]
+        growth_pctl = (1 - alloc_db) * growth_pctl_no_db / 100.0 + alloc_db * 0.5
+            # The greater the defined benefits cushion the greater the growth rate that can be assumed for non-defined benefits.
+        growth_rate = self.distribution_pctl(growth_pctl, 1 + ret, vol) - 1
+        c_factor = self.consume_factor(growth_rate)
+        try:
+            consume = nv * (w[existing_annuities_index] / self.discounted_retirement_le + \
+                            w[new_annuities_index] * mwr / self.discounted_retirement_le_annuity + \
+                            (1 - alloc_db) / c_factor)
+        except ZeroDivisionError:
+            consume = 0 if nv == 0 else float('inf')
+
+        return consume
+
+    def risk_limit(self, use_lm_bonds, w_init, rets, results):
+        # Ideally would scale back using mean-variance optimization, but given the limited number of asset classes, this is good enough.
+
+        def shift(mid):
+
+            w = list(w_init)
+            adjust = mid * w[stocks_index]
+            w[stocks_index] -= adjust
+            w[risk_free_index] += adjust
+
+            if not use_lm_bonds:
+                w[bonds_index] += w[risk_free_index]
+                w[risk_free_index] = 0
+
+            return w
+
+        def loss(mid):
+
+            investments_ret, investments_vol = self.investment_ret_vol(shift(mid), rets)
+
+            return 1 - self.distribution_pctl(loss_pctl_fat_tail, 1 + investments_ret, investments_vol)
+
+        found_loss = None
+        low = -1
+        high = 1
+        for _ in range(50):
+
+            if high - low < 0.0001:
+                break
+
+            mid = (high + low) / 2.0
+
+            investments_loss = loss(mid)
+
+            if found_loss == None:
+                found_loss = investments_loss
+                found_mid = mid
+
+            if investments_loss <= self.risk_tolerance or self.risk_tolerance < investments_loss < found_loss:
+
+                found_loss = investments_loss
+                found_mid = mid
+
+                if mid == 0:
+                    break
+
+                high = mid
+
+            else:
+
+                low = mid
+
+        investments_loss = found_loss
+        w = shift(found_mid)
+
+        ret, vol, geometric_ret = self.portfolio_statistics(self.drop_weights(w, [existing_annuities_index, new_annuities_index]), rets)
+
+        nv = results['nv']
+        consume = self.calc_consume(w, nv, ret, vol, results)
+
+        return w, consume, investments_loss
+
+    def fix_allocs(self, mode, w_prime, rets, results, annuitize):
+
+        purchase_income_annuity = any(a > 0 for a in annuitize)
+
+        w_fixed = [0] * num_index
+        w_fixed[stocks_index] = min(max(0, w_prime[stocks_index] * (1 - annuitize[stocks_index])), 1)
+        w_fixed[bonds_index] = min(max(0, w_prime[bonds_index] * (1 - annuitize[bonds_index])), 1)
+        w_fixed[contrib_index] = w_prime[contrib_index]
+        w_fixed[existing_annuities_index] = w_prime[existing_annuities_index]
+        w_fixed[risk_free_index] = min(max(0, w_prime[risk_free_index] * (1 - annuitize[risk_free_index])), 1)
+
+        if results['nv'] >= 0:
+            alloc_db = 1 - sum(w_fixed)
+        else:
+            alloc_db = -1 - sum(w_fixed)
+        try:
+            w_utilized_home = results['nv_utilized_home'] / abs(results['nv'])
+        except:
+            w_utilized_home = 0
+        rm_drawdown = results['using_reverse_mortgage'] and results['credit_line_age'] <= self.age
+        w_fixed[home_equity_index] = 0 if rm_drawdown else w_utilized_home
+        new_tenure = w_utilized_home if rm_drawdown and results['rm_tenure'] else 0
+        existing_safe = w_fixed[home_equity_index] + new_tenure
+        if self.needed_income != None:
+            try:
+                required_safe = self.discounted_retirement_le_annuity / mwr * \
+                    (self.needed_income / abs(results['nv']) - (existing_safe + w_fixed[existing_annuities_index]) / self.discounted_retirement_le)
+            except ZeroDivisionError:
+                required_safe = float('inf')
+            required_safe += existing_safe
+            required_safe = min(required_safe, 1 - w_fixed[contrib_index] - w_fixed[existing_annuities_index])
+        else:
+            required_safe = float('-inf')
+        if purchase_income_annuity:
+            target_alloc_db = max(existing_safe, required_safe, alloc_db)
+        else:
+            target_alloc_db = existing_safe
+        surplus = alloc_db - target_alloc_db
+        alloc_db = target_alloc_db
+        w_fixed[risk_free_index] += surplus
+        w_fixed[new_annuities_index] = max(0, alloc_db - existing_safe + new_tenure) # Eliminate negative values from fp rounding errors.
+        target_risk_free = min(max(0, w_fixed[risk_free_index], required_safe - alloc_db), 1)
+        surplus = w_fixed[risk_free_index] - target_risk_free
+        w_fixed[risk_free_index] = target_risk_free
+        w_fixed[bonds_index] += surplus
+        target_bonds = min(max(0, w_fixed[bonds_index]), 1)
+        surplus = w_fixed[bonds_index] - target_bonds
+        w_fixed[bonds_index] = target_bonds
+        w_fixed[stocks_index] += surplus
+        w_fixed[stocks_index] = max(0, w_fixed[stocks_index]) # Eliminate negative values from fp rounding errors.
+
+        for count in range(2):
+
+            w_try = list(w_fixed)
+            w_fixed, consume, loss = self.risk_limit(False, w_try, rets, results)
+
+            if self.use_lm_bonds:
+                w_fixed_lm, consume_lm, loss_lm = self.risk_limit(True, w_try, rets, results)
+                if abs(consume_lm) >= abs(consume) and (loss_lm <= self.risk_tolerance or loss_lm <= loss):
+                    w_fixed, consume, loss = w_fixed_lm, consume_lm, loss_lm
+
+            if count == 1 or mode != 'aa' or self.desired_income == None or consume <= self.desired_income:
+                break
+
+            ratio = self.desired_income / consume
+
+            w_fixed = list(w_try)
+            w_fixed[bonds_index] *= ratio
+            w_risk_free_existing = w_fixed[existing_annuities_index] + w_fixed[home_equity_index] + new_tenure
+            w_risk_free_all = w_fixed[risk_free_index] + w_fixed[new_annuities_index] + w_risk_free_existing
+            w_risk_free_new = max(0, max(w_risk_free_all * ratio, required_safe) - w_risk_free_existing)
+            w_annuitize = max(0, w_risk_free_all * annuitize[risk_free_index] - w_risk_free_existing)
+            w_fixed[new_annuities_index] = min(w_risk_free_new, w_annuitize)
+            w_fixed[risk_free_index] = w_risk_free_new - w_fixed[new_annuities_index]
+            w_fixed[stocks_index] = 0
+            w_fixed[stocks_index] = 1 - sum(w_fixed)
+            w_fixed[stocks_index] = max(0, w_fixed[stocks_index]) # Eliminate negative values from fp rounding errors.
+
+        assert(all(w_fixed[i] >= 0 or i in (contrib_index, home_equity_index) for i in range(num_index)))
+        assert(abs(abs(sum(w_fixed)) - 1) < 1e-15)
+
+        total_ret, total_vol, total_geometric_ret = self.portfolio_statistics(w_fixed, rets)
+
+        return w_fixed, consume, new_tenure, total_ret, total_vol, total_geometric_ret
+
+    def calc_scenario(self, mode, description, factor, data, results, force_annuitize):
+
+        rets = [0] * num_index
+        expense = float(data['expense_pct']) / 100
+        rets[stocks_index] = float(data['equity_ret_pct']) / 100 - expense
+        rets[stocks_index] += factor * float(data['equity_se_pct']) / 100
+        rets[bonds_index] = self.yield_curve_nominal.discount_rate(10) - 1 + float(data['bonds_premium_pct']) / 100 - self.inflation - expense
+        rets[contrib_index] = self.ret_contributions
+        rets[risk_free_index] = self.lm_bonds_ret
+        rets[existing_annuities_index] = self.lm_bonds_ret
+        rets[new_annuities_index] = self.lm_bonds_ret
+        rets[home_equity_index] = self.lm_bonds_ret
+
+        equity_gm = self.geomean(1 + rets[stocks_index], self.equity_vol) - 1
+        bonds_gm = self.geomean(1 + rets[bonds_index], self.bonds_vol) - 1
+
+        sigma_matrix = (
+            (self.equity_vol ** 2, self.cov_eb2),
+            (self.cov_eb2, self.bonds_vol ** 2),
+        )
+        alpha = (log(1 + rets[stocks_index]), log(1 + rets[bonds_index]))
+            # Merton's alpha and r are instantaneous expected rates of return.
+            #
+            # Comparing:
+            #
+            #    MERTON: Merton's Lifetime Portfolio Selection Under Uncertainty
+            #    GBM: https://en.wikipedia.org/wiki/Geometric_Brownian_motion
+            #    LND: https://en.wikipedia.org/wiki/Log-normal_distribution
+            #
+            # alphaMERTON = muGBM = muLND + sigmaLND ** 2 / 2 = log(1 + mean(annual_return_rate))
+            #
+            # This last equality being derived from the definitions of mu and sigma in LND in terms of m and v.
+            #
+            # Can thus convert mean annual rates to instantaneous expected rates by taking logs.
+        w = list(self.solve_merton(self.gamma, sigma_matrix, alpha, log(1 + self.lm_bonds_ret)))
+        w.append(1 - sum(w))
+        w_prime = list(w)
+        w_prime = list(max(0, wi) for wi in w_prime)
+        try:
+            contributions = self.nv_contributions / abs(results['nv'])
+        except ZeroDivisionError:
+            contributions = 1
+        w_prime.append(contributions)
+        try:
+            existing_annuities = results['nv_db'] / abs(results['nv'])
+        except ZeroDivisionError:
+            existing_annuities = 0
+        w_prime.append(existing_annuities)
+        w_prime[risk_free_index] = 0
+        w_prime[risk_free_index] = 1 - sum(w_prime)
+
+        annuitize = [0] * num_index
+        w_fixed, consume, new_tenure, total_ret, total_vol, total_geometric_ret = self.fix_allocs(mode, w_prime, rets, results, annuitize)
+        consume_unannuitize = consume
+
+        if self.purchase_income_annuity:
+
+            annuitize[stocks_index] = min(max(0, (self.min_age - 65.0) / (90 - 65)), 1)
+            # Don't have a good handle on when to annuitize regular
+            # bonds.  Results are from earlier work in which bonds
+            # returned 3.1 +/- 11.9% based on historical data.  These
+            # returns are unlikely to be repeated in the forseeable
+            # future.
+            annuitize[bonds_index] = min(max(0, (self.min_age - 30.0) / (60 - 30)), 1)
+            annuitize_lm_bonds_age = min(max(40, 40 + (self.min_age + self.pre_retirement_years - 50) / 2.0), 50)
+            annuitize[risk_free_index] = 0 if self.min_age < annuitize_lm_bonds_age else 1
+
+            w_fixed_annuitize, consume_annuitize, new_tenure_annuitize, total_ret_annuitize, total_vol_annuitize, total_geometric_ret_annuitize = \
+                self.fix_allocs(mode, w_prime, rets, results, annuitize)
+
+            annuitize_gain = consume_annuitize - consume_unannuitize
+            purchase_income_annuity = abs(results['nv']) * (w_fixed_annuitize[new_annuities_index] - new_tenure_annuitize)
+
+            use_age = self.min_age - 5 # Delay cost estimates look forward for 10 years.
+            index = min(int(use_age / 10.0), len(annuitization_delay_cost) - 1)
+            next_index = min(int((use_age + 10) / 10.0), len(annuitization_delay_cost) - 1)
+            cost_low = annuitization_delay_cost[index] / 10
+            cost_high = annuitization_delay_cost[next_index] / 10
+            weight = (use_age % 10) / 10.0
+            cost = (1 - weight) * cost_low + weight * cost_high
+            delay_fraction_cost = cost * w_fixed_annuitize[new_annuities_index]
+            annuitize_delay_cost = abs(results['nv']) * delay_fraction_cost
+
+            if force_annuitize == None:
+                annuitize_plan = annuitize_gain > 0.04 * consume_unannuitize and delay_fraction_cost > 0.001
+            else:
+                annuitize_plan = force_annuitize
+            if annuitize_plan:
+                w_fixed, consume, new_tenure, total_ret, total_vol, total_geometric_ret = \
+                    w_fixed_annuitize, consume_annuitize, new_tenure_annuitize, total_ret_annuitize, total_vol_annuitize, total_geometric_ret_annuitize
+
+        else:
+
+            annuitize_plan = False
+            consume_annuitize = 0
+            annuitize_gain = 0
+            purchase_income_annuity = 0
+            annuitize_delay_cost = 0
+
+        investments_ret, investments_vol, investments_geometric_ret = self.investment_statistics(w_fixed, rets)
+
+        w_fixed_investments = w_fixed[stocks_index] + w_fixed[bonds_index] + w_fixed[risk_free_index]
+        w_total = sum(w_fixed)
+
+        investments_loss = 1 - self.distribution_pctl(loss_pctl_fat_tail, 1 + investments_ret, investments_vol)
+        total_loss = 1 - self.distribution_pctl(loss_pctl_fat_tail, 1 + total_ret, total_vol)
+
+        if results['using_reverse_mortgage']:
+            mortgage_due = 0
+        else:
+            mortgage_due = results['nv_mortgage_payoff']
+        try:
+            unused_home = (results['nv_available_home'] - results['nv_utilized_home']) / abs(results['nv'])
+            unavailable_home = (self.home - mortgage_due - results['nv_available_home']) / abs(results['nv'])
+        except ZeroDivisionError:
+            unused_home = 0
+            unavailable_home = 0
+        w_total_all = w_total + unused_home + unavailable_home
+
+        recommend = []
+        if mode != 'number':
+            recommend.append({
+                'name': 'Future contributions',
+                'npv': '{:,.0f}'.format(w_fixed[contrib_index] * results['nv']),
+                'alloc': '{:.0f}'.format(w_fixed[contrib_index] * 100),
+                'ret': '{:.1f}'.format(self.ret_contributions * 100),
+                'vol': None,
+                'lm_vol': '{:.1f}'.format(self.contribution_vol * 100),
+            })
+        recommend.append({
+            'name': 'Stocks',
+            'npv': '{:,.0f}'.format(w_fixed[stocks_index] * results['nv']),
+            'alloc': '{:.0f}'.format(w_fixed[stocks_index] * 100),
+            'ret': '{:.1f}'.format(rets[stocks_index] * 100),
+            'vol': '{:.1f}'.format(self.equity_vol * 100),
+            'lm_vol': '{:.1f}'.format(self.equity_vol * 100),
+        })
+        recommend.append({
+            'name': 'Regular bonds',
+            'npv': '{:,.0f}'.format(w_fixed[bonds_index] * results['nv']),
+            'alloc': '{:.0f}'.format(w_fixed[bonds_index] * 100),
+            'ret': '{:.1f}'.format(rets[bonds_index] * 100),
+            'vol': '{:.1f}'.format(self.bonds_vol * 100),
+            'lm_vol': '{:.1f}'.format(self.bonds_vol * 100),
+        })
+        recommend.append({
+            'name': 'Liability matching bonds',
+            'npv': '{:,.0f}'.format(w_fixed[risk_free_index] * results['nv']),
+            'alloc': '{:.0f}'.format(w_fixed[risk_free_index] * 100),
+            'ret': '{:.1f}'.format(self.lm_bonds_ret * 100),
+            'vol': '{:.1f}'.format(self.lm_bonds_vol_short * 100),
+            'lm_vol': '{:.1f}'.format(0),
+        })
+        recommend.append({
+            'name': 'Existing defined benefits',
+            'npv': '{:,.0f}'.format(w_fixed[existing_annuities_index] * results['nv']),
+            'alloc': '{:.0f}'.format(w_fixed[existing_annuities_index] * 100),
+            'ret': '{:.1f}'.format(self.lm_bonds_ret * 100),
+            'vol': None,
+            'lm_vol': '{:.1f}'.format(0),
+        })
+        recommend.append({
+            'name': 'New income annuities',
+            'npv': '{:,.0f}'.format(w_fixed[new_annuities_index] * results['nv']),
+            'alloc': '{:.0f}'.format(w_fixed[new_annuities_index] * 100),
+            'ret': '{:.1f}'.format(self.lm_bonds_ret * 100),
+            'vol': None,
+            'lm_vol': '{:.1f}'.format(0),
+        })
+        recommend.append({
+            'name': 'Home equity to be used',
+            'npv': '{:,.0f}'.format(w_fixed[home_equity_index] * results['nv']),
+            'alloc': '{:.0f}'.format(w_fixed[home_equity_index] * 100),
+            'ret': '{:.1f}'.format(self.lm_bonds_ret * 100),
+            'vol': None,
+            'lm_vol': '{:.1f}'.format(self.home_equity_vol * 100),
+        })
+        recommend.append({
+            'name': 'Available home equity not used',
+            'npv': '{:,.0f}'.format(unused_home * results['nv']),
+            'alloc': None,
+            'ret': None,
+            'vol': None,
+            'lm_vol': None,
+        })
+        recommend.append({
+            'name': 'Unavailable home equity',
+            'npv': '{:,.0f}'.format(unavailable_home * results['nv']),
+            'alloc': None,
+            'ret': None,
+            'vol': None,
+            'lm_vol': None,
+        })
+
+        try:
+            aa_equity = w_fixed[stocks_index] / w_fixed_investments
+        except ZeroDivisionError:
+            aa_equity = 1
+        aa_bonds = 1 - aa_equity
+
+        result = {
+            'description': description,
+            'lm_bonds_ret_pct': '{:.1f}'.format(self.lm_bonds_ret * 100),
+            'lm_bonds_duration': '{:.1f}'.format(self.lm_bonds_duration),
+            'retirement_life_expectancy': '{:.1f}'.format(self.retirement_le),
+            'consume': '{:,.0f}'.format(consume),
+            'equity_am_pct':'{:.1f}'.format(rets[stocks_index] * 100),
+            'bonds_am_pct':'{:.1f}'.format(rets[bonds_index] * 100),
+            'equity_gm_pct':'{:.1f}'.format(equity_gm * 100),
+            'bonds_gm_pct':'{:.1f}'.format(bonds_gm * 100),
+            'w' : [{
+                'name': 'Stocks',
+                'alloc': '{:.0f}'.format(w[stocks_index] * 100),
+            }, {
+                'name': 'Regular bonds',
+                'alloc': '{:.0f}'.format(w[bonds_index] * 100),
+            }, {
+                'name': 'Risk free assets',
+                'alloc': '{:.0f}'.format(w[risk_free_index] * 100),
+            }],
+            'w_prime' : [{
+                'name': 'Stocks',
+                'alloc': '{:.0f}'.format(w_prime[stocks_index] * 100),
+            }, {
+                'name': 'Regular bonds',
+                'alloc': '{:.0f}'.format(w_prime[bonds_index] * 100),
+            }, {
+                'name' : 'Future contributions',
+                'alloc': '{:.0f}'.format(w_prime[contrib_index] * 100),
+            }, {
+                'name': 'Defined benefits',
+                'alloc': '{:.0f}'.format(w_prime[existing_annuities_index] * 100),
+            }, {
+                'name': 'Liability matching bonds and home equity',
+                'alloc': '{:.0f}'.format(w_prime[risk_free_index] * 100),
+            }],
+            'annuitize_equity_pct': '{:.0f}'.format(annuitize[stocks_index] * 100),
+            'annuitize_bonds_pct': '{:.0f}'.format(annuitize[bonds_index] * 100),
+            'annuitize_lm_bonds_pct': '{:.0f}'.format(annuitize[risk_free_index] * 100),
+            'annuitize_gain': '{:,.0f}'.format(annuitize_gain),
+            'annuitize_delay_cost': '{:,.0f}'.format(annuitize_delay_cost),
+            'recommend': recommend,
+            'npv_total_all': '{:,.0f}'.format(w_total_all * results['nv']),
+            'alloc_investments_pct': '{:.0f}'.format(w_fixed_investments * 100),
+            'alloc_total_pct': '{:.0f}'.format(w_total * 100),
+            'consume_annuitize': '{:,.0f}'.format(consume_annuitize),
+            'consume_unannuitize': '{:,.0f}'.format(consume_unannuitize),
+            'purchase_income_annuity': '{:,.0f}'.format(purchase_income_annuity),
+            'aa_equity_pct': '{:.0f}'.format(aa_equity * 100),
+            'aa_bonds_pct': '{:.0f}'.format(aa_bonds * 100),
+            'investments_ret_pct': '{:.1f}'.format(investments_ret * 100),
+            'investments_vol_pct': '{:.1f}'.format(investments_vol * 100),
+            'investments_geometric_ret_pct': '{:.1f}'.format(investments_geometric_ret * 100),
+            'total_ret_pct': '{:.1f}'.format(total_ret * 100),
+            'total_vol_pct': '{:.1f}'.format(total_vol * 100),
+            'total_geometric_ret_pct': '{:.1f}'.format(total_geometric_ret * 100),
+            'loss_pctl_pct': '{:.0f}'.format(loss_pctl * 100),
+            'investments_loss_pct': '{:.1f}'.format(investments_loss * 100),
+            'total_loss_pct': '{:.1f}'.format(total_loss * 100),
+            'annuitize_plan': annuitize_plan,
+            'consume_value': consume,
+            'w_fixed': w_fixed,
+            'unavailable_home': unavailable_home,
+            'aa_equity': aa_equity,
+            'aa_bonds': aa_bonds,
+        }
+
+        if mode == 'number':
+            result['w_prime'].pop(2)
+
+        return result
+
+    def number_search(self, scenario, max_portfolio, guess):
+        # Find the smallest location in [0, max_portfolio] at which the consumption of scenario(location) meets the required income.
+        # Guess is either None, or a location and slope of consumption with respect to location from which to start the search.
+        # Returns the location, its scenario, and the slope across the initial bracket.
+
+        tolerance = 0.000001 * max_portfolio
+
+        def excess(location):
+            result = scenario(location)
+            return result['consume_value'] - self.required_income, result
+
+        # Bracket the requirement, extrapolating from the guess if there is one, with a small overshoot so as to land beyond it.
+        low = high = None
+        if guess == None:
+            location = 0
+        else:
+            location, slope = guess
+            location = min(max(0, location), max_portfolio)
+        previous = None
+        while True:
+            value, result = excess(location)
+            if value >= 0:
+                high, high_value, high_result = location, value, result
+                if location == 0:
+                    return location, result, None
+            else:
+                low, low_value = location, value
+                if location == max_portfolio:
+                    return location, result, None # Unable to meet requirement.
+            if low != None and high != None:
+                break
+            if previous != None:
+                slope = (value - previous[1]) / (location - previous[0])
+            if guess == None and previous == None:
+                step = max_portfolio
+            elif slope != None and slope > 0:
+                step = 1.1 * abs(value) / slope + tolerance
+            else:
+                step = max_portfolio # Not increasing, give up on extrapolating.
+            previous = (location, value)
+            if value >= 0:
+                location = max(0, location - step)
+            else:
+                location = min(location + step, max_portfolio)
+        slope = (high_value - low_value) / (high - low)
+
+        # Refine using Brent's method. Consume may have a discontinuity due to annuitization, so return the lowest location found to meet or
+        # exceed the requirement, rather than Brent's root estimate. Brent's method terminates with it within tolerance of the root.
+        evaluated = {low: (low_value, None), high: (high_value, high_result)}
+
+        def f(location):
+            try:
+                return evaluated[location][0]
+            except KeyError:
+                evaluated[location] = excess(location)
+                return evaluated[location][0]
+
+        brentq(f, low, high, xtol = tolerance)
+        high = min(location for location, (value, result) in evaluated.items() if value >= 0)
+        high_result = evaluated[high][1]
+
+        return high, high_result, slope
+
+    def retirement_setup(self, data, mode, retirement_age):
+        # A copy of this object set up for the given retirement age, along with its setup_calc() results.
+        # The retirement age independent setup is shared, and the retirement age dependent setup is only performed once for each age.
+
+        try:
+            return self.retirement_setups[retirement_age]
+        except KeyError:
+            pass
+
+        alloc = copy(self)
+        results = dict(self.common_results)
+        npv_results, npv_display = alloc.setup_calc_retirement(dict(data, retirement_age = str(retirement_age)), mode, results)
+        self.retirement_setups[retirement_age] = (alloc, results, npv_results, npv_display)
+
+        return self.retirement_setups[retirement_age]
+
+    def retirement_scenario(self, mode, description, factor, data, force_annuitize, retirement_age):
+
+        alloc, results, npv_results, npv_display = self.retirement_setup(data, mode, retirement_age)
+        calc_result = alloc.calc_scenario(mode, description, factor, data, npv_results, force_annuitize)
+
+        return results, npv_display, calc_result
+
+    def retirement_curve(self, mode, description, factor, data, force_annuitize, retirement_ages):
+        # Consumption as a function of retirement age, for 'retire' mode after compute_results().
+
+        return [(retirement_age, self.retirement_scenario(mode, description, factor, data, force_annuitize, retirement_age)[2]['consume_value'])
+            for retirement_age in retirement_ages]
+
+    def calc(self, mode, description, factor, data, results, npv_results, npv_display, force_annuitize):
+
+        if mode == 'aa':
+
+            calc_result = self.calc_scenario(mode, description, factor, data, npv_results, force_annuitize)
+
+        elif mode == 'number':
+
+            nv = npv_results['nv']
+            max_portfolio = self.required_income * (120 - self.min_age - self.pre_retirement_years)
+
+            def scenario(location):
+                # Hack the table rather than recompute for speed.
+                npv_results['nv'] = nv + location
+                return self.calc_scenario(mode, description, factor, data, npv_results, force_annuitize)
+
+            if factor == 0:
+                found_location, found_value, slope = self.number_search(scenario, max_portfolio, None)
+                self.number_guess = (found_location, slope)
+            else:
+                found_location, found_value, _ = self.number_search(scenario, max_portfolio, self.number_guess) # Warm start from the baseline estimate.
+
+            found_value['taxable'] = found_location
+
+            _, npv_display = self.value_table(self.nv_db, found_location) # Recompute.
+            npv_results['nv'] = nv
+
+            calc_result = found_value
+
+        else:
+
+            lo = ceil(float(data['age'])) - 1
+            hi = 120
+            while True:
+                mid = int(ceil((lo + hi) / 2.0))
+                new_results, npv_display, calc_result = self.retirement_scenario(mode, description, factor, data, force_annuitize, mid)
+                if mid == hi:
+                    break
+                if calc_result['consume_value'] >= float(data['required_income']):
+                    hi = mid
+                else:
+                    lo = mid
+
+            retirement_age = float('inf') if mid == 120 else mid
+            calc_result['retirement_age'] = '{:.0f}'.format(retirement_age)
+            if factor == 0:
+                results = new_results
+                min_age = int(ceil(float(data['age'])))
+                retirement_ages = range(max(min_age, mid - retirement_curve_span), min(mid + retirement_curve_span, 120) + 1)
+                curve = self.retirement_curve(mode, description, factor, data, force_annuitize, retirement_ages)
+                results['retirement_curve'] = [{
+                    'retirement_age': '{:.0f}'.format(retirement_age),
+                    'consume': '{:,.0f}'.format(consume),
+                } for retirement_age, consume in curve]
+
+        calc_result['npv_display'] = npv_display
+
+        return results, calc_result
+
+    def setup_calc(self, data, mode):
+
+        results = self.setup_calc_common(data, mode)
+        npv_results, npv_display = self.setup_calc_retirement(data, mode, results)
+
+        return results, npv_results, npv_display
+
+    def setup_calc_common(self, data, mode):
+        # Retirement age independent part of setup_calc().
+
+        results = {}
+
+        self.yield_curve_nominal_average_cache = {}
+
+        self.date_str = data['date']
+        self.real_rate = None if data['real_rate_pct'] == None else float(data['real_rate_pct']) / 100
+        self.inflation = float(data['inflation_pct']) / 100
+        if self.real_rate == None:
+            self.yield_curve_real = get_yield_curve('real', self.date_str)
+            self.yield_curve_nominal = get_yield_curve('nominal', self.date_str)
+        else:
+            self.yield_curve_real = get_yield_curve('fixed', self.date_str, adjust = self.real_rate)
+            self.yield_curve_nominal = get_yield_curve('fixed', self.date_str, adjust = self.real_rate + self.inflation)
+        self.yield_curve_zero = get_yield_curve('fixed', self.date_str)
+
+        if self.yield_curve_real.yield_curve_date == self.yield_curve_nominal.yield_curve_date:
+            results['yield_curve_date'] = self.yield_curve_real.yield_curve_date;
+        else:
+            results['yield_curve_date'] = self.yield_curve_real.yield_curve_date + ' real, ' + \
+                self.yield_curve_nominal.yield_curve_date + ' nominal';
+
+        self.table = 'ssa-cohort'
+        self.table_annuity = 'iam2012-basic'
+
+        self.sex = data['sex']
+        self.age = float(data['age'])
+        self.le_set = float(data['le_set']) - self.age if data['le_set'] else None
+        self.life_table = LifeTable(self.table, self.sex, self.age, le_set = self.le_set, date_str = self.date_str)
+        self.life_table_annuity = LifeTable(self.table_annuity, self.sex, self.age, ae = 'aer2005_08-summary')
+
+        self.sex2 = data['sex2']
+        if self.sex2 == 'none':
+            self.life_table2 = None
+            self.life_table2_annuity = None
+            self.min_age = self.age
+        else:
+            self.age2 = float(data['age2']);
+            self.le_set2 = float(data['le_set2']) - self.age2 if data['le_set2'] else None
+            self.life_table2 = LifeTable(self.table, self.sex2, self.age2, le_set = self.le_set2, date_str = self.date_str)
+            self.life_table2_annuity = LifeTable(self.table_annuity, self.sex2, self.age2, ae = 'aer2005_08-summary')
+            self.min_age = min(self.age, self.age2)
+
+        self.db = data['db']
+        if mode != 'number':
+            self.traditional = float(data['p_traditional_iras'])
+            self.tax_rate = float(data['tax_rate_pct']) / 100
+            self.npv_roth = float(data['p_roth_iras'])
+            self.npv_taxable = float(data['p'])
+            self.contribution = float(data['contribution'])
+            self.contribution_reduction = float(data['contribution_reduction'])
+            self.contribution_growth = float(data['contribution_growth_pct']) / 100
+            self.contribution_vol = float(data['contribution_vol_pct']) / 100
+        else:
+            self.traditional = 0
+            self.tax_rate = 0
+            self.npv_roth = 0
+            self.npv_taxable = 0
+            self.contribution = 0
+            self.contribution_reduction = 0
+            self.contribution_growth = 0
+            self.contribution_vol = 0
+        if mode != 'aa':
+            self.required_income = float(data['required_income'])
+        self.home = float(data['home'])
+        self.home_ret = float(data['home_ret_pct']) / 100
+        self.home_vol = float(data['home_vol_pct']) / 100
+        self.mortgage = float(data['mortgage'])
+        self.mortgage_payment = float(data['mortgage_payment'])
+        self.mortgage_rate = float(data['mortgage_rate_pct']) / 100
+        self.rm_loc = float(data['rm_loc'])
+        self.purchase_income_annuity = data['purchase_income_annuity']
+        self.have_rm = data['have_rm']
+        self.use_rm = data['use_rm']
+        self.rm_delay = None if data['rm_delay'] == None else float(data['rm_delay'])
+        self.rm_plf = None if data['rm_plf'] == None else float(data['rm_plf'])
+        self.rm_interest_rate_premium = float(data['rm_interest_rate_premium_pct']) / 100
+        self.rm_interest_rate = None if data['rm_interest_rate_pct'] == None else float(data['rm_interest_rate_pct']) / 100
+        self.rm_cost = float(data['rm_cost'])
+        self.rm_age = float(data['rm_age'])
+        self.rm_tenure_limit = float(data['rm_tenure_limit'])
+        self.rm_tenure_duration = float(data['rm_tenure_duration'])
+        self.rm_eligible = float(data['rm_eligible'])
+        self.joint_payout_fraction = float(data['joint_income_pct']) / 100
+        self.needed_income = None if data['needed_income'] == None else float(data['needed_income'])
+        self.desired_income = None if data['desired_income'] == None else float(data['desired_income'])
+        self.use_lm_bonds = data['use_lm_bonds']
+        self.bonds_vol_short = float(data['bonds_vol_pct']) / 100
+        self.bonds_lm_bonds_corr_short = float(data['bonds_lm_bonds_corr_short_pct']) / 100
+        self.risk_tolerance = float(data['risk_tolerance_pct']) / 100
+        self.rm_margin = float(data['rm_margin_pct']) / 100
+        self.rm_insurance_initial = float(data['rm_insurance_initial_pct']) / 100
+        self.rm_insurance_annual = float(data['rm_insurance_annual_pct']) / 100
+
+        self.frequency = 12 # Monthly. Makes accurate, doesn't run significantly slower.
+        self.cpi_adjust = 'calendar'
+
+        self.real_vol = float(data['real_vol_10yr_pct']) / 100
+        self.gamma = float(data['gamma'])
+        self.equity_vol = float(data['equity_vol_pct']) / 100
+        self.bonds_vol = float(data['bonds_vol_pct']) / 100
+        self.lm_bonds_vol = 0
+
+        self.equity_bonds_corr = float(data['equity_bonds_corr_pct']) / 100
+        self.cov_eb2 = self.equity_vol * self.bonds_vol * self.equity_bonds_corr ** 2
+        self.cov_bl2 = 0
+
+        return results
+
+    def setup_calc_retirement(self, data, mode, results):
+        # Retirement age dependent part of setup_calc(). Adds to results.
+
+        self.retirement_age = float(data['retirement_age'])
+        self.retirement_age2 = None if data['retirement_age2'] == None else float(data['retirement_age2'])
+        pre_retirement_years1 = max(0, self.retirement_age - self.age)
+        if self.retirement_age2 != None:
+            pre_retirement_years2 = max(0, self.retirement_age2 - self.age2)
+        else:
+            pre_retirement_years2 = pre_retirement_years1
+        self.pre_retirement_years = max(pre_retirement_years1, pre_retirement_years2)
+        self.pre_retirement_years_full_contrib = min(pre_retirement_years1, pre_retirement_years2)
+
+        results['pre_retirement_years'] = '{:.1f}'.format(self.pre_retirement_years)
+
+        self.nv_contributions, self.ret_contributions = self.npv_contrib()
+
+        display_db, self.nv_db = self.value_table_db()
+        npv_results, npv_display = self.value_table(self.nv_db, self.npv_taxable)
+        results['db'] = []
+        for db in display_db:
+            results['db'].append({'present': db})
+
+        self.home_equity_vol = npv_results['home_equity_vol']
+
+        payout_delay = self.pre_retirement_years * 12
+        scenario = Scenario(self.yield_curve_zero, payout_delay, None, None, 0, self.life_table, life_table2 = self.life_table2, \
+            joint_payout_fraction = self.joint_payout_fraction, joint_contingent = True, \
+            period_certain = 0, frequency = self.frequency, cpi_adjust = self.cpi_adjust)
+        self.retirement_le = scenario.price()
+
+        scenario = Scenario(self.yield_curve_real, payout_delay, None, None, 0, self.life_table_annuity, life_table2 = self.life_table2_annuity, \
+            joint_payout_fraction = self.joint_payout_fraction, joint_contingent = True, \
+            period_certain = 0, frequency = self.frequency, cpi_adjust = self.cpi_adjust)
+        self.discounted_retirement_le_annuity = scenario.price()
+
+        scenario = Scenario(self.yield_curve_real, payout_delay, None, None, 0, self.life_table, life_table2 = self.life_table2, \
+            joint_payout_fraction = self.joint_payout_fraction, joint_contingent = True, \
+            period_certain = 0, frequency = self.frequency, cpi_adjust = self.cpi_adjust)
+        self.discounted_retirement_le = scenario.price()
+        self.lm_bonds_ret = scenario.annual_return
+        self.lm_bonds_duration = scenario.duration
+
+        self.consume_payouts = self.consume_profile()
+
+        modified_duration = self.lm_bonds_duration / (1 + self.lm_bonds_ret)
+        self.lm_bonds_vol_short = modified_duration / 10.0 * self.real_vol
+        self.cov_bl2_short = self.bonds_vol_short * self.lm_bonds_vol_short * self.bonds_lm_bonds_corr_short ** 2
+
+        return npv_results, npv_display
+
+    def calc_results(self, mode, data, results, npv_results, npv_display):
+
+        confidence = float(data['confidence_pct']) / 100
+        factor = normal_ppf(0.5 + confidence / 2)
+        factor = float(factor) # De-numpyfy.
+        results, baseline = self.calc(mode, 'Baseline estimate', 0, data, results, npv_results, npv_display, None)
+        _, low = self.calc(mode, 'Low returns estimate', - factor, data, results, npv_results, npv_display, baseline['annuitize_plan'])
+        _, high = self.calc(mode, 'High returns estimate', factor, data, results, npv_results, npv_display, baseline['annuitize_plan'])
+        results['calc'] = (baseline, low, high)
+        results['present'] = results['calc'][0]['npv_display'] # Use baseline scenario for common calculations display.
+
+        return results
+
+    def compute_results(self, data, mode):
+
+        if mode == 'retire':
+            # Retirement age dependent setup is performed by calc() for each retirement age considered.
+            self.common_results = self.setup_calc_common(data, mode)
+            self.retirement_setups = {}
+            results = npv_results = npv_display = None
+        else:
+            results, npv_results, npv_display = self.setup_calc(data, mode)
+
+        results = self.calc_results(mode, data, results, npv_results, npv_display)
+
+        return results
+
+normal_ppf_cache = {}
+
+def normal_ppf(pctl):
+    # Standard normal quantile. Cached, as only a few fixed percentiles, such as loss_pctl_fat_tail, are used repeatedly.
+
+    try:
+        return normal_ppf_cache[pctl]
+    except KeyError:
+        z = float(ndtri(pctl))  # De-numpyfy.
+        if len(normal_ppf_cache) < 1000:
+            normal_ppf_cache[pctl] = z
+        return z
+
+def round_half_away(x):
+    # Vectorized round() to an integer valued float. Rounds half away from zero, as round() does.
+
+    a = abs(x)
+    r = floor(a + 0.5)
+    r = where(r - a > 0.5, r - 1, r)  # a + 0.5 may itself have been rounded up.
+
+    return copysign(r, x)
+
+class HecmPlf:
+    # HECM principal limit factor table held as a dense 2-D array indexed by age and by expected rate in steps of 1/8%.
+    # Ages and rates missing from the table have a principal limit factor of zero.
+
+    def __init__(self, path):
+
+        plfs = {}
+
+        with open(path) as f:
+
+            csv = reader(f)
+            assert(next(csv)[0] == 'Age')
+
+            for line in csv:
+                if (line[0] != ''):
+                    age = int(line[0])
+                    if age not in plfs:
+                        plfs[age] = {}
+                    for i in range(1, len(line), 2):
+                        rate = float(line[i])
+                        step = int(round(rate * 8))
+                        assert(step == rate * 8)
+                        plfs[age][step] = float(line[i + 1])
+
+        self.min_age = min(plfs.keys())
+        self.max_age = max(plfs.keys())
+        steps = tuple(step for age_plfs in plfs.values() for step in age_plfs.keys())
+        self.min_step = min(steps)
+        num_steps = max(steps) - self.min_step + 1
+
+        self.plf = zeros((self.max_age - self.min_age + 1, num_steps))
+        self.present = zeros(self.plf.shape, dtype = bool)
+        self.age_min_steps = full(len(self.plf), self.min_step + num_steps, dtype = int)  # Lowest rate step for each age.
+        for age, age_plfs in plfs.items():
+            for step, plf in age_plfs.items():
+                self.plf[age - self.min_age, step - self.min_step] = plf
+                self.present[age - self.min_age, step - self.min_step] = True
+            self.age_min_steps[age - self.min_age] = min(age_plfs.keys())
+
+    def lookup(self, plf_ages, expected_rate_pcts):
+        # Principal limit factors for arrays of ages and expected rates.
+        # Ages are truncated to whole years and limited to the oldest age in the table, and rates are rounded to the nearest 1/8% and
+        # raised to the lowest rate in the table.
+
+        ages = minimum(trunc(plf_ages), self.max_age) - self.min_age
+        valid = (ages >= 0) & isfinite(expected_rate_pcts)
+        ages = where(valid, ages, 0).astype(int)
+        steps = maximum(round_half_away(where(valid, expected_rate_pcts, 0) * 8), self.age_min_steps[ages]) - self.min_step
+        valid &= steps < self.plf.shape[1]
+        steps = where(valid, steps, 0).astype(int)
+        valid &= self.present[ages, steps]
+
+        return where(valid, self.plf[ages, steps], 0)
+
+def load_hecm():
+
+    for datadir in datapath:
+        datadir = normpath(expanduser(datadir))
+        if isdir(datadir):
+            break
+
+    return HecmPlf(join(datadir, 'hecm', hecm_plf_file))
+
+def load_yield_curve_special():
+
+    start = '1990-01-01'
+    end = '2016-12-31'
+
+    name = 'special-average-' + start + '-' + end
+
+    return get_yield_curve('nominal', name)
+
+hecm_plf = None
+
+def get_hecm_plf():
+
+    global hecm_plf
+
+    if hecm_plf == None:
+        hecm_plf = load_hecm()
+
+    return hecm_plf
+
+def get_yield_curve_nominal_average():
+
+    # Held in the yield curve cache.
+    return load_yield_curve_special()
+
+def compute_alloc(data, mode = 'aa'):
+    # Compute the results for a dict of alloc parameters, using the default parameters for any that are missing.
+    # Raises the same exceptions as Alloc.compute_results.
+
+    alloc = Alloc()
+    params = alloc.default_alloc_params()
+    params.update(data)
+
+    return alloc.compute_results(params, mode)
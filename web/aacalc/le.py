@@ -0,0 +1,93 @@
+# AACalc - Asset Allocation Calculator
+# Copyright (C) 2009, 2011-2017 Gordon Irlam
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Life expectancy calculation and the precomputed daily life expectancy tables.
+# Does not depend on Django, so the tables can be generated by batch scripts.
+
+from datetime import datetime, timedelta
+from os import getpid, listdir, makedirs, remove, rename
+from os.path import isdir, isfile, join
+from re import match
+
+from numpy import array, savez_compressed, uint16, zeros
+
+from aacalc.spia import LifeTable, Scenario, datadir, get_yield_curve
+
+le_percentiles = (None, 80, 90, 95, 98, 99, )
+
+# Precomputed life expectancy tables. One file per day covering every integer age for each table and sex, and couples whose ages differ by
+# no more than le_table_age_difference. Life expectancies are stored in hundredths of a year, exactly as displayed.
+le_table_tables = ('ssa-cohort', 'iam2012-basic', 'ssa-period')
+le_table_sexes = ('male', 'female')
+le_table_max_age = 110
+le_table_age_difference = 10
+
+def compute_le(table, date_str, sex, age, sex2, age2):
+
+    yield_curve = get_yield_curve('le', date_str)
+    life_table = LifeTable(table, sex, age, ae = 'aer2005_08-summary')
+    if sex2 == None:
+        life_table2 = None
+    else:
+        life_table2 = LifeTable(table, sex2, age2, ae = 'aer2005_08-summary')
+    scenario = Scenario(yield_curve, 0, None, None, 0, life_table, life_table2 = life_table2, frequency = 12)
+
+    return scenario.price_percentiles(le_percentiles)
+
+def le_table_path(date_str):
+
+    return join(datadir, 'le', 'le-' + date_str + '.npz')
+
+def gen_le_table(date_str):
+
+    singles = zeros((len(le_table_tables), len(le_table_sexes), le_table_max_age + 1, len(le_percentiles)), dtype = uint16)
+    couples = zeros((len(le_table_tables), len(le_table_sexes), len(le_table_sexes), le_table_max_age + 1, 2 * le_table_age_difference + 1,
+        len(le_percentiles)), dtype = uint16)
+
+    def centiyears(le):
+        return tuple(int(round(float("%.2f" % (l, )) * 100)) for l in le)
+
+    for t, table in enumerate(le_table_tables):
+        for s, sex in enumerate(le_table_sexes):
+            for age in range(le_table_max_age + 1):
+                singles[t, s, age] = centiyears(compute_le(table, date_str, sex, age, None, None))
+                for s2, sex2 in enumerate(le_table_sexes):
+                    for d in range(2 * le_table_age_difference + 1):
+                        age2 = age + d - le_table_age_difference
+                        if 0 <= age2 <= le_table_max_age:
+                            couples[t, s, s2, age, d] = centiyears(compute_le(table, date_str, sex, age, sex2, age2))
+
+    path = le_table_path(date_str)
+    tmp_path = path + '.' + str(getpid()) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        savez_compressed(f, date = array(date_str), singles = singles, couples = couples)
+    rename(tmp_path, path)
+
+def update_le_tables():
+    # Generate the tables for today and tomorrow, so that a table is available as soon as the date changes, and remove old tables.
+
+    today = datetime.utcnow().date()
+    dates = (today.isoformat(), (today + timedelta(days = 1)).isoformat())
+    le_dir = join(datadir, 'le')
+    if not isdir(le_dir):
+        makedirs(le_dir)
+    for date_str in dates:
+        if not isfile(le_table_path(date_str)):
+            gen_le_table(date_str)
+    for filename in listdir(le_dir):
+        m = match(r'^le-([0-9]{4}-[0-9]{2}-[0-9]{2})\.npz$', filename)
+        if m and m.group(1) < dates[0]:
+            remove(join(le_dir, filename))
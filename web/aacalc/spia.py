@@ -17,13 +17,21 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from argparse import ArgumentParser
+from bisect import bisect
 from calendar import monthrange
+from collections import OrderedDict
 from csv import reader
+from datetime import datetime, timedelta
 from math import exp
+from multiprocessing import Pool
+from os import fstat, getpid, listdir, rename, stat
 from os.path import expanduser, isdir, join, normpath
+from re import match
+from threading import Lock
 
-from numpy import errstate
+from numpy import arange, array, asarray, concatenate, cumprod, empty, errstate, floor, full, isnan, load, maximum, minimum, nan, newaxis, ones, power, repeat, save, savez, searchsorted, where, zeros
 from scipy.interpolate import InterpolatedUnivariateSpline, PchipInterpolator
+from scipy.optimize import brentq
 
 datapath = ('~/aacalc/opal/data/public', '~ubuntu/aacalc/opal/data/public')
 
@@ -44,6 +52,21 @@ long_rate = {
 
 # Using a forward rate of 2.5% on maturities beyond 30 years reduces the MWR by 2% at age 48.
 
+# Maximum number of fully built yield curves to retain in the process wide yield curve cache.
+yield_curve_cache_size = 100
+
+# Maximum number of life table q_adjust calibrations to retain.
+q_adjust_cache_size = 1000
+
+# Default engine used by Scenario.price():
+#     'numpy' - vectorized.
+#     'python' - the reference implementation, one payout at a time.
+#     'parity' - vectorized, but also run the reference implementation and check they agree.
+price_engine = 'numpy'
+price_parity_tolerance = 1e-9  # Maximum relative difference allowed between the two engines in parity mode.
+
+survival_block = 128  # Number of q values to compute at a time when building survival curves.
+
 iam2012_date = 2012
 
 iam2012_basic_1000_q = {
@@ -766,6 +789,216 @@ ssa2010_q = {
     ),
 }
 
+def store_date(date_str):
+
+    year, month, day = date_str.split('-')
+
+    return int(year) * 10000 + int(month) * 100 + int(day)
+
+class TreasuryStore:
+    # Indexed columnar store of the daily Treasury par yield curves held in the per year cmt/nominal-YYYY.csv or rcmt/real-YYYY.csv files.
+    #
+    # Compiled to a single memory mapped .npy array. Row 0 holds the maturities in years. Column 0 holds the quote dates as YYYYMMDD
+    # values in ascending order. The remaining cells hold the par rates in percent, or nan if the maturity wasn't quoted on that date.
+    # Dates on which no maturities were quoted are omitted.
+
+    def __init__(self, interest_rate):
+
+        self.interest_rate = interest_rate
+        self.dir = join(datadir, 'rcmt' if interest_rate == 'real' else 'cmt')
+        self.path = join(self.dir, interest_rate + '.npy')
+
+        self.source_mtimes = self.get_source_mtimes()
+
+        try:
+            stale = stat(self.path).st_mtime < max(self.source_mtimes.values() or (0, ))
+        except OSError:
+            stale = True
+
+        if stale:
+            table = self.compile()
+            try:
+                tmp_path = self.path + '.' + str(getpid()) + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    save(f, table)
+                rename(tmp_path, self.path)
+            except (IOError, OSError):
+                pass  # Probably don't have write permission. Use the compiled store without saving it.
+        else:
+            table = load(self.path, mmap_mode = 'r')
+
+        self.years = table[0, 1:]
+        self.dates = table[1:, 0]
+        self.rates = table[1:, 1:]
+
+    def source_path(self, year):
+
+        return join(self.dir, self.interest_rate + '-' + str(year) + '.csv')
+
+    def get_source_mtimes(self):
+
+        source_mtimes = {}
+        try:
+            for filename in listdir(self.dir):
+                if match('^' + self.interest_rate + '-[0-9]{4}\.csv$', filename):
+                    path = join(self.dir, filename)
+                    source_mtimes[path] = stat(path).st_mtime
+        except OSError:
+            pass
+
+        return source_mtimes
+
+    def compile(self):
+
+        all_years = set()
+        quotes = []
+        for path in sorted(self.source_mtimes.keys()):
+
+            with open(path) as f:
+
+                csv = reader(f)
+                assert(next(csv)[0].startswith('#'))
+
+                years = next(csv)
+                years.pop(0)
+                years = tuple(float(v) for v in years)
+                all_years.update(years)
+
+                for line in csv:
+                    d = line[0]
+                    rate = line[1:]
+                    assert(len(years) == len(rate))
+                    if not all(r == '' for r in rate):
+                        quotes.append((store_date(d), dict((y, float(r)) for y, r in zip(years, rate) if r != '')))
+
+        all_years = sorted(all_years)
+        quotes.sort(key = lambda quote: quote[0])
+
+        table = empty((len(quotes) + 1, len(all_years) + 1))
+        table.fill(nan)
+        table[0, 1:] = all_years
+        for i, (date, rates) in enumerate(quotes):
+            table[i + 1, 0] = date
+            for j, year in enumerate(all_years):
+                table[i + 1, j + 1] = rates.get(year, nan)
+
+        return table
+
+treasury_stores = {}
+treasury_stores_lock = Lock()
+
+def get_treasury_store(interest_rate):
+    # Return the compiled store, recompiling it if the underlying CSV files have changed.
+
+    with treasury_stores_lock:
+        store = treasury_stores.get(interest_rate)
+        if store is None or store.get_source_mtimes() != store.source_mtimes:
+            store = TreasuryStore(interest_rate)
+            treasury_stores[interest_rate] = store
+
+    return store
+
+class AverageYieldCurveStore:
+    # Precomputed average of the daily Treasury spot yield curves from date_str_low to date_str, for use by the special yield curve
+    # named average_yield_curve_name(date_str_low, date_str).
+    #
+    # Saved as a .npz file alongside the Treasury store. Holds the sum of the projected spot yield curves, the sum of the shortest par
+    # rates, the number of quotes summed, and the date of the last quote included as a YYYYMMDD value. Because sums are kept, when the
+    # end of the window moves the store can be built by extending the store for the same start with the latest earlier end.
+
+    def __init__(self, interest_rate, date_str_low, date_str):
+
+        self.interest_rate = interest_rate
+        self.date_str_low = date_str_low
+        self.date_str = date_str
+        self.dir = join(datadir, 'rcmt' if interest_rate == 'real' else 'cmt')
+        self.path = self.store_path(date_str)
+
+    def store_path(self, date_str):
+
+        return join(self.dir, self.interest_rate + '-' + average_yield_curve_name(self.date_str_low, date_str) + '.npz')
+
+    def load(self, path = None):
+        # Return the saved sums, or None if not present.
+
+        if path == None:
+            path = self.path
+
+        try:
+            with open(path, 'rb') as f:
+                npz = load(f)
+                sums = dict((k, npz[k]) for k in npz.files)
+                sums['path'] = path
+                sums['mtime'] = fstat(f.fileno()).st_mtime
+                return sums
+        except IOError:
+            return None
+
+    def prior_path(self):
+        # Path of the store with the same start and the latest end not after date_str, or None.
+
+        prefix = self.interest_rate + '-' + average_yield_curve_name(self.date_str_low, '')
+        ends = []
+        for filename in listdir(self.dir):
+            if filename.startswith(prefix) and filename.endswith('.npz'):
+                end = filename[len(prefix):-len('.npz')]
+                if match('^[0-9]{4}-[0-9]{2}-[0-9]{2}$', end) and end <= self.date_str:
+                    ends.append(end)
+
+        if ends:
+            return self.store_path(max(ends))
+        else:
+            return None
+
+    def compile(self):
+        # Build and save the store. Returns the sums.
+
+        sums = None
+        prior_path = self.prior_path()
+        if prior_path != None:
+            sums = self.load(prior_path)
+        if sums == None:
+            sums = {'spot_sum': zeros(200), 'par_short_sum': 0.0, 'count': 0, 'last_date': 0}
+            date_str_low = self.date_str_low
+        else:
+            last_date = datetime.strptime(str(int(sums['last_date'])), '%Y%m%d').date()
+            date_str_low = (last_date + timedelta(days = 1)).isoformat()
+
+        try:
+            yield_curve = YieldCurve(self.interest_rate, self.date_str, date_str_low = date_str_low)
+        except YieldCurve.NoData:
+            pass  # No new quotes.
+        else:
+            store = get_treasury_store(self.interest_rate)
+            sums = {
+                'spot_sum': sums['spot_sum'] + yield_curve.spot_sum,
+                'par_short_sum': sums['par_short_sum'] + yield_curve.par_short_sum,
+                'count': sums['count'] + yield_curve.quote_count,
+                'last_date': int(store.dates[store.dates.searchsorted(store_date(self.date_str), 'right') - 1]),
+            }
+        if sums['count'] == 0:
+            raise YieldCurve.NoData
+
+        tmp_path = self.path + '.' + str(getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            savez(f, spot_sum = sums['spot_sum'], par_short_sum = sums['par_short_sum'], count = sums['count'], last_date = sums['last_date'])
+        rename(tmp_path, self.path)
+
+        return sums
+
+def average_yield_curve_name(date_str_low, date_str):
+
+    return 'special-average-' + date_str_low + '-' + date_str
+
+def get_average_yield_curve_sums(interest_rate, date_str):
+    # Return the precomputed sums for the special yield curve date_str if it is a precomputed average, otherwise None.
+
+    dates = match('^special-average-([0-9]{4}-[0-9]{2}-[0-9]{2})-([0-9]{4}-[0-9]{2}-[0-9]{2})$', date_str)
+    if not dates:
+        return None
+
+    return AverageYieldCurveStore(interest_rate, dates.group(1), dates.group(2)).load()
+
 class YieldCurve:
 
     class NoData(Exception):
@@ -773,6 +1006,50 @@ class YieldCurve:
 
     def get_treasury(self, date_str, date_str_low):
 
+        try:
+            date_year = int(date_str.split('-')[0])
+        except ValueError:
+            # Special yield curve; not part of the store.
+            return self.get_treasury_csv(date_str, date_str_low)
+
+        if date_str_low:
+            date_year_low = int(date_str_low.split('-')[0])
+        else:
+            date_year_low = date_year - 1
+
+        store = get_treasury_store(self.interest_rate)
+        for year in range(date_year_low, date_year + 1):
+            path = store.source_path(year)
+            self.data_files[path] = store.source_mtimes.get(path)
+
+        end = store.dates.searchsorted(store_date(date_str), 'right')
+        if date_str_low:
+            start = store.dates.searchsorted(store_date(date_str_low))
+        else:
+            start = max(0, end - 1)
+            if start < end and store.dates[start] < store_date(str(date_year_low) + '-01-01'):
+                start = end
+
+        yield_curve_years = []
+        yield_curve_rates = []
+        for rate in store.rates[start:end]:
+            quoted = ~ isnan(rate)
+            yield_curve_years.append(tuple(store.years[quoted].tolist()))
+            yield_curve_rates.append(tuple(rate[quoted].tolist()))
+
+        if len(yield_curve_rates) == 0:
+            raise self.NoData
+        elif len(yield_curve_rates) == 1:
+            date = int(store.dates[start])
+            yield_curve_date_str = '%04d-%02d-%02d' % (date // 10000, date // 100 % 100, date % 100)
+        else:
+            yield_curve_date_str = date_str_low + ' - ' + date_str
+
+        return yield_curve_years, yield_curve_rates, yield_curve_date_str
+
+    def get_treasury_csv(self, date_str, date_str_low):
+        # Scan the CSV files directly. Only needed for special yield curves, otherwise get_treasury uses the compiled store.
+
         date_year_str = date_str.split('-')[0]
         special = False
         try:
@@ -793,10 +1070,14 @@ class YieldCurve:
 
             year_str = date_year_str if special else str(year)
 
+            path = join(datadir, 'rcmt' if self.interest_rate == 'real' else 'cmt', self.interest_rate + '-' + year_str + '.csv')
+            self.data_files[path] = None
+
             try:
 
-                with open(join(datadir, 'rcmt' if self.interest_rate == 'real' else 'cmt', self.interest_rate + '-' + year_str + '.csv')) as f:
+                with open(path) as f:
 
+                    self.data_files[path] = fstat(f.fileno()).st_mtime
                     csv = reader(f)
                     assert(next(csv)[0].startswith('#'))
 
@@ -864,10 +1145,14 @@ class YieldCurve:
         file_year_offset = (date_year - 1984) % year_step
         file_name = 'hqm_%(start)02d_%(end)02d' % {'start' : file_year % 100, 'end' : (file_year + year_step - 1) % 100}
 
+        path = join(datadir, 'hqm', file_name + '.csv')
+        self.data_files[path] = None
+
         try:
 
-            with open(join(datadir, 'hqm', file_name + '.csv')) as f:
+            with open(path) as f:
 
+                self.data_files[path] = fstat(f.fileno()).st_mtime
                 csv = reader(f)
                 line = next(csv)
                 line = next(csv)
@@ -906,25 +1191,28 @@ class YieldCurve:
 
         return [spot_years], [spot_rates], spot_date
 
-    def project_curve(self, spot_years, spot_rates):
+    def project_curves(self, spot_years, spot_rates):
 
         # Project returns beyond the last rate using the average 15 year and longer forward rate (similar to Treasury methodology)
         # and beyond long_years using long_rate as the forward rate.
-        spot_yield_curve = spot_rates[:2 * long_years[self.interest_rate]]
-        forward_rates = self.spot_to_forward(spot_yield_curve)
-        long_forward_rates = []
-        for i in range(len(forward_rates)):
-            if spot_years[i] >= 15:
-                long_forward_rates.append(forward_rates[i])
-        try:
-            long_forward_rate = sum(long_forward_rates) / len(long_forward_rates)
-        except ZeroDivisionError:
+        # Each row of the 2-D array spot_rates is a yield curve with the same number of maturities.
+        spot_years = array(spot_years)
+        spot_yield_curves = spot_rates[:, :2 * long_years[self.interest_rate]]
+        forward_rates = self.spot_to_forward_array(spot_yield_curves)
+        count = forward_rates.shape[1]
+        long_maturities = spot_years[:count] >= 15
+        if not long_maturities.any():
             raise self.NoData
-        forward_rates.extend([long_forward_rate] * (len(spot_years) - len(forward_rates)))
-        for i in range(len(spot_years)):
-            if spot_years[i] > long_years[self.interest_rate]:
-                forward_rates[i] = long_rate[self.interest_rate]
-        return self.forward_to_spot(forward_rates)
+        long_forward_rates = forward_rates[:, long_maturities].sum(axis = 1) / long_maturities.sum()
+        projected_forward_rates = empty((len(spot_rates), len(spot_years)))
+        projected_forward_rates[:, :count] = forward_rates
+        projected_forward_rates[:, count:] = long_forward_rates[:, newaxis]
+        projected_forward_rates[:, spot_years > long_years[self.interest_rate]] = long_rate[self.interest_rate]
+        return self.forward_to_spot_array(projected_forward_rates)
+
+    def project_curve(self, spot_years, spot_rates):
+
+        return self.project_curves(spot_years, array((spot_rates, )))[0].tolist()
 
     def __init__(self, interest_rate, date_str, date_str_low = None, adjust = 0, interpolate_rates = True):
         self.interest_rate = interest_rate
@@ -934,45 +1222,64 @@ class YieldCurve:
         self.date_str_low = date_str_low  # Compute average of all spot curves from date_str_low to date_str.
         self.interpolate_rates = interpolate_rates  # Whether to interpolate interest rates. Set to true for compatibility with AACalc. Neglible difference.
         self.adjust = adjust  # Adjustment to apply to all annualized rates.
+        self.data_files = {}  # Modification time of each data file consulted, or None if it didn't exist. Used to invalidate cached yield curves.
 
-        if interest_rate in ('real', 'nominal'):
+        average = None
+        if interest_rate in ('real', 'nominal') and not date_str_low:
+            average = get_average_yield_curve_sums(interest_rate, date_str)
+
+        if average != None:
+
+            # Precomputed by AverageYieldCurveStore.
+            self.yield_curve_date = date_str
+            self.data_files[average['path']] = average['mtime']
+            spot_years = tuple(y / 2.0 for y in range(1, 201))
+            spot_yield_curve = tuple((average['spot_sum'] / average['count']).tolist())
+            if interest_rate == 'nominal':
+                rf_say = float(average['par_short_sum'] / average['count'])
+                self.risk_free_rate = (1 + rf_say / 2) ** 2 - 1
+            spot_yield_curve = tuple(r + adjust for r in spot_yield_curve)
+            self.set_yield_curve(spot_years, spot_yield_curve)
+
+            return
+
+        elif interest_rate in ('real', 'nominal'):
 
             yield_curve_years, yield_curve_rates, self.yield_curve_date = self.get_treasury(date_str, date_str_low)
 
-            spot_rates = []
+            coupon_yield_curves = {}  # Lists of coupon yield curves indexed by the number of maturities present.
             for yield_curve_year, yield_curve_rate in zip(yield_curve_years, yield_curve_rates):
 
                 # Project returns beyond available returns data using the last forward rate.
                 # Not compatible with AACalc. To begin with the underlying splines don't match.
-                coupon_yield_curve = []
                 # Suppress spurious divide by zero; needed for Ubuntu 14.04, not needed for Scipy 0.16.1.
                 with errstate(divide='ignore'):
                     yield_curve = PchipInterpolator(yield_curve_year, yield_curve_rate)
                         # PchipInterpolator was refactored in Scipy 0.14 (Ubuntu 16.04) and the interpolation curves are not compatible.
                         # This means SPIA prices will differ between Ubuntu 14.04 and Ubuntu 16.04.
 
-                for i in range(1, int(2 * max(yield_curve_year)) + 1):
-                    year = i / 2.0
-                    # For out of range values Scipy just uses the polynominal, which is problematic, so we use linear interpolation in this case.
-                    if year < min(yield_curve_year):
-                        try:
-                            slope = yield_curve(min(yield_curve_year), 1)
-                        except TypeError:
-                            slope = yield_curve.derivative(min(yield_curve_year)) # Ubuntu 14.04 (SciPy 0.13.3) and earlier.
-                        slope = float(slope)  # De-numpy-fy.
-                        rate = yield_curve_rate[0] + slope * (year - min(yield_curve_year))
-                    else:
-                        rate = float(yield_curve(year))
-                    coupon_yield_curve.append(rate / 100.0)
-
-                spot_rate = self.par_to_spot(coupon_yield_curve)
-                    # Does not match spot rates at https://www.treasury.gov/resource-center/economic-policy/corp-bond-yield/Pages/TNC-YC.aspx
-                    # because the input par rates of the daily quotes used differ from the end of month quotes reported there.
-                spot_rates.append(spot_rate)
+                years = arange(1, int(2 * max(yield_curve_year)) + 1) / 2.0
+                min_year = min(yield_curve_year)
+                # For out of range values Scipy just uses the polynominal, which is problematic, so we use linear interpolation in this case.
+                try:
+                    slope = yield_curve(min_year, 1)
+                except TypeError:
+                    slope = yield_curve.derivative(min_year) # Ubuntu 14.04 (SciPy 0.13.3) and earlier.
+                slope = float(slope)  # De-numpy-fy.
+                rates = where(years < min_year, yield_curve_rate[0] + slope * (years - min_year), yield_curve(years))
+                coupon_yield_curves.setdefault(len(years), []).append(rates / 100.0)
+
+            spot_rates = list(self.par_to_spot_array(array(curves)) for curves in coupon_yield_curves.values())
+                # Does not match spot rates at https://www.treasury.gov/resource-center/economic-policy/corp-bond-yield/Pages/TNC-YC.aspx
+                # because the input par rates of the daily quotes used differ from the end of month quotes reported there.
+
+            # Sums used to build and extend average yield curve stores.
+            self.quote_count = len(yield_curve_rates)
+            self.par_short_sum = sum(yield_curve_rate[0] / 100.0 for yield_curve_rate in yield_curve_rates)
 
             if interest_rate == 'nominal':
 
-                rf_say = sum(yield_curve_rate[0] / 100.0 for yield_curve_rate in yield_curve_rates) / len(yield_curve_rates)
+                rf_say = self.par_short_sum / self.quote_count
                 self.risk_free_rate = (1 + rf_say / 2) ** 2 - 1
 
         elif interest_rate == 'corporate':
@@ -983,6 +1290,7 @@ class YieldCurve:
                 spot_years, spot_rates, self.yield_curve_date = self.get_corporate(date_year, date_str, date_str_low)
             except self.NoData:
                 spot_years, spot_rates, self.yield_curve_date = self.get_corporate(date_year - 1, date_str, date_str_low)
+            spot_rates = [spot_rates]
 
         elif interest_rate in ('fixed', 'le'):
 
@@ -992,8 +1300,9 @@ class YieldCurve:
 
         spot_years = tuple(y / 2.0 for y in range(1, 201))
 
-        spot_yield_curves = tuple(self.project_curve(spot_years, spot_rate) for spot_rate in spot_rates)
-        spot_yield_curve = tuple(sum(rates) / len(rates) for rates in zip(*spot_yield_curves))
+        spot_yield_curves = concatenate(tuple(self.project_curves(spot_years, array(rates)) for rates in spot_rates))
+        self.spot_sum = spot_yield_curves.sum(axis = 0)
+        spot_yield_curve = tuple((self.spot_sum / len(spot_yield_curves)).tolist())
 
         spot_yield_curve = tuple(r + adjust for r in spot_yield_curve)
 
@@ -1057,6 +1366,44 @@ class YieldCurve:
             spots.append((spot_rate - 1) * 2)
         return spots
 
+    # Vectorized versions of the above conversions. Each row of the 2-D array rates is a separate yield curve.
+
+    def par_to_spot_array(self, rates):
+        spots = empty(rates.shape)
+        discount_rate_sum = zeros(len(rates))
+        for i in range(rates.shape[1]):
+            coupon_yield = rates[:, i] / 2.0
+            discount_rate = (1 - coupon_yield * discount_rate_sum) / (1 + coupon_yield)
+            spots[:, i] = (discount_rate ** (- 1.0 / (i + 1)) - 1) * 2
+            discount_rate_sum += discount_rate
+        return spots
+
+    def spot_to_par_array(self, rates):
+        pars = empty(rates.shape)
+        forwards = self.spot_to_forward_array(rates)
+        coupons = zeros(len(rates))
+        for i in range(rates.shape[1]):
+            coupons = 1 + coupons * (1 + forwards[:, i] / 2)
+            pars[:, i] = ((1 + rates[:, i] / 2) ** (i + 1) - 1) / coupons * 2
+        return pars
+
+    def spot_to_forward_array(self, rates):
+        count = arange(1, rates.shape[1] + 1)
+        new_spot_rates = rates / 2
+        old_spot_rates = zeros(rates.shape)
+        old_spot_rates[:, 1:] = new_spot_rates[:, :-1]
+        forward_rates = (1 + new_spot_rates) ** count / (1 + old_spot_rates) ** (count - 1)
+        return (forward_rates - 1) * 2
+
+    def forward_to_spot_array(self, rates):
+        spots = empty(rates.shape)
+        spot_rate = ones(len(rates))
+        for i in range(rates.shape[1]):
+            forward_rate = 1 + rates[:, i] / 2
+            spot_rate = (forward_rate * spot_rate ** i) ** (1.0 / (i + 1))
+            spots[:, i] = (spot_rate - 1) * 2
+        return spots
+
     def discount_rate(self, y):
         if self.interest_rate == 'fixed':
             ay = 1 + self.adjust
@@ -1076,6 +1423,119 @@ class YieldCurve:
             ay = (1 + say / 2) ** 2  # Convert semi-annual yields to annual yields.
         return ay
 
+    def discount_rates(self, years):
+        # Vectorized discount_rate(); a single yield curve evaluation for a whole array of years.
+        years = asarray(years, dtype = float)
+        if self.interest_rate == 'fixed':
+            return full(years.shape, 1 + self.adjust)
+        elif self.interest_rate == 'le':
+            return ones(years.shape)
+        else:
+            if self.interpolate_rates:
+                look_years = years
+            else:
+                look_years = floor(years * 2 + 0.5) / 2.0  # Round half away from zero, as round() does.
+                look_years = maximum(0.5, look_years)
+            if self.spot_years_min <= self.spot_years_max:
+                yield_curve = self.yield_curve_in_range
+            else:
+                yield_curve = self.yield_curve_out_range
+            say = yield_curve(look_years)
+            return power(1 + say / 2, 2.0)  # Numpy implements ** 2 by squaring, which can differ from discount_rate() in the last bit.
+
+    def discount_factors(self, years):
+        # Present value of one dollar received at each of an array of years.
+        years = asarray(years, dtype = float)
+        return 1 / self.discount_rates(years) ** years
+
+def data_files_unchanged(data_files):
+
+    for path, mtime in data_files.items():
+        try:
+            current_mtime = stat(path).st_mtime
+        except OSError:
+            current_mtime = None
+        if current_mtime != mtime:
+            return False
+
+    return True
+
+yield_curve_cache = OrderedDict()
+yield_curve_cache_lock = Lock()
+
+def get_yield_curve(interest_rate, date_str, date_str_low = None, adjust = 0, interpolate_rates = True):
+    # Return a shared YieldCurve from the process wide LRU cache, building it if necessary.
+    # Cached curves are rebuilt if any of the data files they were built from have since changed, such as after fetch_yield_curve runs.
+    # The returned yield curve is shared and must not be modified.
+
+    key = (interest_rate, date_str, date_str_low, adjust, interpolate_rates)
+
+    with yield_curve_cache_lock:
+        yield_curve = yield_curve_cache.pop(key, None)
+        if yield_curve is not None:
+            yield_curve_cache[key] = yield_curve  # Most recently used.
+
+    if yield_curve is not None and data_files_unchanged(yield_curve.data_files):
+        return yield_curve
+
+    yield_curve = YieldCurve(interest_rate, date_str, date_str_low = date_str_low, adjust = adjust, interpolate_rates = interpolate_rates)
+
+    with yield_curve_cache_lock:
+        yield_curve_cache[key] = yield_curve
+        while len(yield_curve_cache) > yield_curve_cache_size:
+            yield_curve_cache.popitem(last = False)
+
+    return yield_curve
+
+q_adjust_cache = OrderedDict()  # False if unable to adjust.
+q_adjust_cache_lock = Lock()
+
+def aer2014_ratio(sex, ae, c, age):
+    # Actual/expected ratio for contract year bucket c and age.
+
+    if ae == 'aer2005_08-summary':
+        return aer2014_actual_expected[sex]['all'][c]
+    else:
+        age_5 = int(age / 5) * 5
+        ascending_ae = (aer2014_actual_expected[sex].get(a, (None, ) * 4)[c] for a in range(age_5, 121, 5))
+        try:
+            return next(ratio for ratio in ascending_ae if ratio is not None)
+        except StopIteration:
+            descending_ae = (aer2014_actual_expected[sex].get(a, (None, ) * 4)[c] for a in range(age_5, -1, -5))
+            return next(ratio for ratio in descending_ae if ratio is not None)
+
+life_table_arrays = {}
+
+def get_life_table_arrays(table, sex, ae):
+    # Dense arrays of the underlying q values of a life table, shared by all LifeTables with the same table, sex, and a/e ratios.
+
+    key = (table, sex, ae)
+    try:
+        return life_table_arrays[key]
+    except KeyError:
+        pass
+
+    arrays = {}
+    if table == 'iam2012-basic':
+        arrays['q'] = array(iam2012_basic_1000_q[sex]) / 1000.0
+        arrays['g2'] = array(projection_scale_g2[sex], dtype = float)
+        if ae == 'none':
+            ae_ratios = tuple((1, ) * len(arrays['q']) for c in range(len(aer2014_years)))
+        else:
+            ae_ratios = tuple(tuple(aer2014_ratio(sex, ae, c, age) for age in range(len(arrays['q']))) for c in range(len(aer2014_years)))
+        arrays['ae_ratios'] = ae_ratios  # Indexed by contract year bucket, then age.
+        arrays['ae'] = array(ae_ratios, dtype = float)
+    elif table == 'ssa-cohort':
+        cohorts = sorted(ssa_as120_q[sex].keys())
+        assert(cohorts == range(cohorts[0], cohorts[-1] + 1, 10))
+        arrays['cohort_start'] = cohorts[0]
+        arrays['q'] = array(tuple(ssa_as120_q[sex][cohort] for cohort in cohorts))  # Indexed by cohort decade, then age.
+    elif table == 'ssa-period':
+        arrays['q'] = array(ssa2010_q[sex], dtype = float)
+
+    life_table_arrays[key] = arrays
+    return arrays
+
 class LifeTable:
 
     class UnableToAdjust(Exception):
@@ -1104,27 +1564,72 @@ class LifeTable:
         self.m = m # Gompertz-Makeham parameter.
         self.b = b # Gompertz-Makeham parameter.
 
+        self.arrays = get_life_table_arrays(table, sex, ae)
+
+        self.survival_cache = {}  # Scenario survival curves with this as the first life table.
+        self.survival_cache_q_adjust = None  # The q_adjust in effect when survival_cache was populated.
+
         self.q_adjust = 1
         if le_set == None and le_add == 0:
             return
-        yield_curve = YieldCurve('le', date_str)
+
+        key = (table, sex, age, death_age, ae, le_set, le_add, date_str, interpolate_q, alpha, m, b)
+        with q_adjust_cache_lock:
+            q_adjust = q_adjust_cache.pop(key, None)
+            if q_adjust is not None:
+                q_adjust_cache[key] = q_adjust  # Most recently used.
+        if q_adjust is None:
+            try:
+                q_adjust = self.calibrate_q_adjust(le_set, le_add)
+            except self.UnableToAdjust:
+                q_adjust = False
+            with q_adjust_cache_lock:
+                q_adjust_cache[key] = q_adjust
+                while len(q_adjust_cache) > q_adjust_cache_size:
+                    q_adjust_cache.popitem(last = False)
+        if q_adjust is False:
+            raise self.UnableToAdjust
+        self.q_adjust = q_adjust
+
+    def calibrate_q_adjust(self, le_set, le_add):
+        # Find the q_adjust that gives a life expectancy of le_set + le_add, or the current life expectancy plus le_add if le_set is None.
+        # Life expectancy is computed directly from the unadjusted q values for each candidate q_adjust, rather than pricing a full Scenario.
+
+        yield_curve = get_yield_curve('le', self.date_str)
+        scenario = Scenario(yield_curve, 0, None, None, 0, self)
+        start = scenario.start_time()
+        update_period = scenario.frequency if scenario.annual_q else 1
+        q_bases = []
+        i = 0
+        while True:
+            # Unadjusted q values through until death is certain. Adjusting q never postpones certain death.
+            y = arange(i, i + survival_block, dtype = float) * update_period / scenario.frequency
+            q_base = self.q_base_array(start + y, self.age + y, y)
+            dead = self.q_adjusted_array(q_base, 1) == 1
+            if dead.any():
+                q_bases.append(tuple(part[:dead.argmax() + 1] for part in q_base))
+                break
+            q_bases.append(q_base)
+            i += survival_block
+        q_base = tuple(concatenate(parts) for parts in zip(*q_bases))
+
+        def life_expectancy(q_adjust):
+            q = self.q_adjusted_array(q_base, q_adjust)
+            periods = (q == 1).argmax()
+            survival = scenario.survival_from_q(q[:periods], ones(periods))
+            return scenario.price(engine = 'numpy', survival = survival)
+
         if le_set == None:
-            scenario = Scenario(yield_curve, 0, None, None, 0, self)
-            le_set = scenario.price()
+            le_set = life_expectancy(1)
         le = le_set + le_add
         q_lo = 0
         q_hi = 10
-        for _ in range(50):
-            self.q_adjust = (q_lo + q_hi) / 2.0
-            scenario = Scenario(yield_curve, 0, None, None, 0, self)
-            compute_le = scenario.price()
-            if abs(le / compute_le - 1) < 1e-4:
-                return
-            if compute_le > le:
-                q_lo = self.q_adjust
-            else:
-                q_hi = self.q_adjust
-        raise self.UnableToAdjust
+        if not life_expectancy(q_hi) <= le <= life_expectancy(q_lo):
+            raise self.UnableToAdjust
+        q_adjust = brentq(lambda q_adjust: life_expectancy(q_adjust) - le, q_lo, q_hi, xtol = 1e-12)
+        if abs(le / life_expectancy(q_adjust) - 1) >= 1e-4:
+            raise self.UnableToAdjust
+        return q_adjust
 
     def iam_q(self, year, age, contract_age):
         year = int(year)
@@ -1133,23 +1638,8 @@ class LifeTable:
         q = iam2012_basic_1000_q[self.sex][age] / 1000.0;
         g2 = projection_scale_g2[self.sex][age];
         contract_year = contract_age + 1  # AER starts at year 1.
-        if self.ae != 'none':
-            if contract_year > max(aer2014_years):
-                c = aer2014_years.index(max(aer2014_years))
-            else:
-                c = aer2014_years.index(max(cy for cy in aer2014_years if cy <= contract_year))
-            if self.ae == 'aer2005_08-summary':
-                ae = aer2014_actual_expected[self.sex]['all'][c]
-            else:
-                age_5 = int(age / 5) * 5
-                ascending_ae = (aer2014_actual_expected[self.sex].get(a, (None, ) * 4)[c] for a in range(age_5, 121, 5))
-                try:
-                    ae = next(ratio for ratio in ascending_ae if ratio is not None)
-                except StopIteration:
-                    descending_ae = (aer2014_actual_expected[self.sex].get(a, (None, ) * 4)[c] for a in range(age_5, -1, -5))
-                    ae = next(ratio for ratio in descending_ae if ratio is not None)
-        else:
-            ae = 1
+        c = bisect(aer2014_years, contract_year) - 1
+        ae = self.arrays['ae_ratios'][c][age]
         return q * (1 - g2) ** (year - iam2012_date) * ae
 
     def ssa_cohort_q(self, cohort, age):
@@ -1195,6 +1685,90 @@ class LifeTable:
             age = int(age)
             return self.q_int(cohort, year, age, contract_age)
 
+    def q_int_base_array(self, cohorts, years, ages, contract_ages):
+        # Vectorized q_int(), prior to applying q_adjust. Nan where there is no data for the cohort.
+        if self.table == 'live':
+            q = zeros(ages.shape)
+        elif self.table == 'iam2012-basic':
+            table_q = self.arrays['q']
+            in_table = ages < len(table_q)
+            a = minimum(ages, len(table_q) - 1)
+            c = searchsorted(aer2014_years, contract_ages + 1, side = 'right') - 1  # AER starts at year 1.
+            q = table_q[a] * power(1 - self.arrays['g2'][a], years.astype(int) - iam2012_date) * self.arrays['ae'][c, a]
+            q = where(in_table, q, 1)
+        elif self.table == 'ssa-cohort':
+            table_q = self.arrays['q']
+            cohorts = cohorts - 0.5  # Cohort is people born in a given year.
+            cohort_fract = (cohorts % 10) / 10
+            cohort_index = (cohorts / 10).astype(int) - self.arrays['cohort_start'] // 10
+            in_table = ages < table_q.shape[1]
+            missing = (cohort_index < 0) | (cohort_index >= table_q.shape[0]) | in_table & (cohort_index + 1 >= table_q.shape[0])
+            c = minimum(maximum(cohort_index, 0), table_q.shape[0] - 2)
+            a = minimum(ages, table_q.shape[1] - 1)
+            q = (1 - cohort_fract) * table_q[c, a] + cohort_fract * table_q[c + 1, a]
+            q = where(in_table, q, 1)
+            q = where(missing, nan, q)
+        else:
+            table_q = self.arrays['q']
+            q = where(ages < len(table_q), table_q[minimum(ages, len(table_q) - 1)], 1)
+        return q
+
+    def q_base_array(self, years, ages, contract_ages):
+        # The parts of q_array() that don't depend on q_adjust.
+        # Returns the unadjusted q values at the ages on either side, the interpolation fraction between them, and whether death is forced.
+        years = asarray(years, dtype = float)
+        ages = asarray(ages, dtype = float)
+        contract_ages = asarray(contract_ages, dtype = float)
+        if self.table == 'gompertz-makeham':
+            q = array(tuple(max(0, min(self.alpha + exp((age - self.m) / self.b) / self.b, 1)) for age in ages.tolist()), dtype = float)
+            q_lo, q_hi, fract = q, q, zeros(ages.shape)
+        else:
+            cohorts = years - ages
+            age_nearest = (self.table in ('iam2012-basic', 'ssa-cohort', 'ssa-period'))
+            if self.interpolate_q:
+                q_ages = ages if age_nearest else ages - 0.5
+                fract = q_ages % 1
+                q_ages = q_ages.astype(int)
+                q_lo = self.q_int_base_array(cohorts, years, q_ages, contract_ages)
+                q_hi = self.q_int_base_array(cohorts, years, q_ages + 1, contract_ages)
+            else:
+                q_ages = ages + 0.5 if age_nearest else ages
+                q_lo = self.q_int_base_array(cohorts, years, q_ages.astype(int), contract_ages)
+                q_hi, fract = q_lo, zeros(ages.shape)
+        return q_lo, q_hi, fract, ages >= self.death_age
+
+    def q_adjusted_array(self, q_base, q_adjust):
+        # Complete q_array() given the result of q_base_array() and a q_adjust value.
+        q_lo, q_hi, fract, dead = q_base
+        if self.table != 'gompertz-makeham':
+            q_lo = where(q_lo == 1, 1, minimum(q_lo * q_adjust, 1))
+            q_hi = where(q_hi == 1, 1, minimum(q_hi * q_adjust, 1))
+        q = (1 - fract) * q_lo + fract * q_hi
+        q = where(dead, 1, q)
+        if isnan(q).any():
+            raise KeyError('No life table data for cohort')
+        return q
+
+    def q_array(self, years, ages, contract_ages):
+        # Vectorized q(). Takes arrays of years, ages, and contract ages.
+        return self.q_adjusted_array(self.q_base_array(years, ages, contract_ages), self.q_adjust)
+
+class Calcs:
+    # Payout by payout breakdown of a Scenario price. Each field is an array with one entry per payout.
+
+    fields = ('i', 'y', 'alive', 'joint', 'combined', 'payout_fraction', 'interest_rate', 'fair_price')
+
+    def __init__(self, **fields):
+        for field in self.fields:
+            setattr(self, field, array(fields[field], dtype = int if field == 'i' else float))
+
+    def __len__(self):
+        return len(self.i)
+
+    def append(self, **fields):
+        for field in self.fields:
+            setattr(self, field, concatenate((getattr(self, field), (fields[field], ))))
+
 class Scenario:
 
     def __init__(self, yield_curve, payout_delay, premium, payout, tax, life_table1, life_table2 = None, \
@@ -1229,15 +1803,75 @@ class Scenario:
             # Updating at every payout is wrong, since the annuitant never gets to experience the calculated q value for the full year.
             # Updating every payout reduces MWR by 2% at age 90.
 
-    def price(self):
+    def start_time(self):
 
-        current_age1 = self.life_table1.age
-        current_age2 = self.life_table2.age if self.life_table2 else None
         starting_date = self.date if self.date else self.yield_curve.date
         start_year, m, d = starting_date.split('-')
         start_year = int(start_year)
         start_month = int(m) - 1 + (float(d) - 1) / monthrange(start_year, int(m))[1]
-        start = start_year + start_month / 12
+        return start_year + start_month / 12
+
+    def price(self, engine = None, calcs = False, survival = None, grid = None):
+        # Set calcs to have the payout by payout breakdown of the price saved as self.calcs.
+        # Survival is an optional precomputed result of self.survival(self.start_time()) shared between scenarios differing only in their payouts.
+        # Grid is an optional precomputed result of payout_grid() for a scenario differing from this one at most in percentile, tax, and mwr.
+
+        if engine == None:
+            engine = price_engine
+        assert(engine in ('numpy', 'python', 'parity'))
+
+        want_calcs = calcs
+        if engine == 'python':
+            price, duration, annual_return, total_payout, calcs = self.payouts_python()
+        else:
+            price, duration, annual_return, total_payout, calcs = self.payouts_numpy(want_calcs or engine == 'parity', survival, grid)
+            if engine == 'parity':
+                self.check_parity((price, duration, annual_return, total_payout, calcs), self.payouts_python())
+
+        price, self.duration, self.annual_return, self.total_payout = self.results((price, duration, annual_return, total_payout, calcs))
+        self.calcs = calcs if want_calcs else None
+        return price
+
+    def results(self, payouts):
+        # Convert the summed payouts returned by payouts_python() or payouts_numpy() into the price, duration, annual return, and total payout.
+
+        price, duration, annual_return, total_payout, _ = payouts
+        try:
+            duration /= price
+        except ZeroDivisionError:
+            assert(duration == 0)
+            duration = 0
+        try:
+            annual_return = annual_return / total_payout - 1
+        except ZeroDivisionError:
+            annual_return = 0
+        total_payout /= self.frequency
+        try:
+            price /= self.frequency * (1 - self.tax) * self.mwr
+        except ZeroDivisionError:
+            price = float('inf')
+        return price, duration, annual_return, total_payout
+
+    def check_parity(self, numpy_results, python_results):
+
+        def close(a, b):
+            return abs(a - b) <= price_parity_tolerance * max(abs(a), abs(b), 1)
+
+        for a, b in zip(numpy_results[:4], python_results[:4]):
+            assert close(a, b), 'Numpy and python pricing engines disagree: %s %s' % (numpy_results[:4], python_results[:4])
+        numpy_calcs = numpy_results[4]
+        python_calcs = python_results[4]
+        assert len(numpy_calcs) == len(python_calcs), 'Numpy and python pricing engines disagree on the number of payouts: %d %d' % (len(numpy_calcs), len(python_calcs))
+        for field in Calcs.fields:
+            for n, (a, b) in enumerate(zip(getattr(numpy_calcs, field), getattr(python_calcs, field))):
+                assert close(a, b), 'Numpy and python pricing engines disagree on %s of payout %d: %s %s' % (field, n, a, b)
+
+    def payouts_python(self):
+        # Reference implementation. Computes the same quantities as payouts_numpy(), one period at a time.
+
+        current_age1 = self.life_table1.age
+        current_age2 = self.life_table2.age if self.life_table2 else None
+        start = self.start_time()
         alive1 = 1.0
         alive2 = 1.0
         alive_array = [1.0]
@@ -1334,22 +1968,293 @@ class Scenario:
             calc = {'i': i, 'y': y, 'alive': 0.0, 'joint': 0.0, 'combined': 0.0, 'payout_fraction': payout_fraction, 'interest_rate': r, 'fair_price': payout_value}
             calcs.append(calc)
 
+        calcs = Calcs(**dict((field, [calc[field] for calc in calcs]) for field in Calcs.fields))
+
+        return price, duration, annual_return, total_payout, calcs
+
+    def survival(self, start):
+        # Probability of full and of joint payout at each payout period since the start date.
+        # Cached on the first life table since the same life tables get priced repeatedly with different yield curves, delays, and schedules.
+
+        cache = self.life_table1.survival_cache
+        if self.life_table1.survival_cache_q_adjust != self.life_table1.q_adjust:
+            cache.clear()
+            self.life_table1.survival_cache_q_adjust = self.life_table1.q_adjust
+        key = (self.life_table2, self.life_table2.q_adjust if self.life_table2 else None, start, self.frequency, self.annual_q, self.joint_contingent)
         try:
-            self.duration = duration / price
-        except ZeroDivisionError:
-            assert(duration == 0)
-            self.duration = 0
-        try:
-            self.annual_return = annual_return / total_payout - 1
-        except ZeroDivisionError:
-            self.annual_return = 0
-        self.total_payout = total_payout / self.frequency
+            return cache[key]
+        except KeyError:
+            pass
+
+        current_age1 = self.life_table1.age
+        current_age2 = self.life_table2.age if self.life_table2 else None
+        update_period = self.frequency if self.annual_q else 1
+        q1s = []
+        q2s = []
+        i = 0
+        while True:
+            # Compute q values a block of periods at a time until both annuitants are certain to be dead.
+            y = arange(i, i + survival_block, dtype = float) * update_period / self.frequency
+            q1 = self.life_table1.q_array(start + y, current_age1 + y, y)
+            q2 = ones(len(y)) if current_age2 is None else self.life_table2.q_array(start + y, current_age2 + y, y)
+            dead = (q1 == 1) & (q2 == 1)
+            if dead.any():
+                q1s.append(q1[:dead.argmax()])
+                q2s.append(q2[:dead.argmax()])
+                break
+            q1s.append(q1)
+            q2s.append(q2)
+            i += survival_block
+        alive_array, joint_array = self.survival_from_q(concatenate(q1s), concatenate(q2s))
+        alive_array.flags.writeable = False  # Shared by all users of the cache.
+        joint_array.flags.writeable = False
+
+        cache[key] = (alive_array, joint_array)
+
+        return alive_array, joint_array
+
+    def survival_from_q(self, q1s, q2s):
+        # Survival curves given the q values of each annuitant for each q update period.
+
+        update_period = self.frequency if self.annual_q else 1
+        alive1 = cumprod(repeat(power(1 - q1s, 1.0 / self.frequency), update_period))
+        alive2 = cumprod(repeat(power(1 - q2s, 1.0 / self.frequency), update_period))
+        if self.joint_contingent:
+            alive = alive1 - alive1 * (1 - alive2)
+            joint = alive2 * (1 - alive1) + alive1 * (1 - alive2)
+        else:
+            alive = alive1
+            joint = alive2 * (1 - alive1)
+        alive = where(alive2 == 0, alive1, alive)
+        joint = where(alive2 == 0, 0, joint)
+        alive_array = concatenate(([1.0], alive))
+        joint_array = concatenate(([0.0], joint))
+
+        return alive_array, joint_array
+
+    def payouts_numpy(self, calcs = True, survival = None, grid = None):
+        # Vectorized implementation of payouts_python(). Calcs is only built if requested.
+
+        if grid == None:
+            grid = self.payout_grid(survival)
+        return self.payouts_from_grid(grid, self.percentile, calcs)
+
+    def payout_grid(self, survival = None):
+        # Vectorized computation of everything about each payout that doesn't depend on the percentile.
+        # Returned arrays cover every payout until the survival curve runs out, with y, r, discount, and schedule having one additional
+        # entry for the period at which payouts stop.
+
+        start = self.start_time()
+        alive_array, joint_array = survival if survival != None else self.survival(start)
+
+        delay = self.payout_delay / 12.0
+        # Payout periods up to and including the first one falling beyond the end of the survival arrays.
+        count = max(1, len(alive_array) - int(delay * self.frequency) + 2)
+        i = arange(count)
+        period = i / float(self.frequency)
+        y = delay + period
+        index = y * self.frequency
+        fract = index % 1
+        index = index.astype(int)
+        beyond = index + 1 >= len(alive_array)
+        assert(beyond[-1])
+        stop = beyond.argmax()
+
+        index = index[:stop]
+        fract = fract[:stop]
+        certain = period[:stop] < float(self.period_certain)
+        alive = where(certain, 1.0, (1 - fract) * alive_array[index] + fract * alive_array[index + 1])
+        joint = where(certain, 0.0, (1 - fract) * joint_array[index] + fract * joint_array[index + 1])
+        combined = alive + self.joint_payout_fraction * joint
+
+        # Interest rates are for the time of the payout, except real rates which may be only updated once per year.
+        y = y[:stop + 1]
+        rates = self.yield_curve.discount_rates(y)
+        if self.yield_curve.interest_rate != 'real' or self.cpi_adjust == 'all':
+            rate_index = arange(stop + 1)
+        else:
+            first_payout = start + delay + 1e-9  # 1e-9: avoid floating point rounding problems when payout_delay computed for the next modal period.
+            months_since_adjust = 0 if self.cpi_adjust == 'payout' else (first_payout % 1) * 12
+            adjust_count = floor((months_since_adjust + arange(stop + 1) * 12.0 / self.frequency) / 12)
+            adjust = concatenate(([False], adjust_count[1:] > adjust_count[:-1]))
+            rate_index = maximum.accumulate(where(adjust, arange(stop + 1), 0))
+        r = rates[rate_index]
+        discount = r ** y[rate_index]
+
+        schedule = array([self.schedule(year) for year in y.tolist()], dtype = float)
+
+        return {
+            'y': y,
+            'alive': alive,
+            'joint': joint,
+            'combined': combined,
+            'r': r,
+            'discount': discount,
+            'schedule': schedule,
+        }
+
+    def payouts_from_grid(self, grid, percentile, calcs = False):
+        # Payouts_numpy() for the given percentile using the result of payout_grid().
+
+        y = grid['y']
+        alive = grid['alive']
+        joint = grid['joint']
+        combined = grid['combined']
+        r = grid['r']
+        discount = grid['discount']
+        schedule = grid['schedule']
+        stop = len(combined)
+        prev_combined = concatenate(([1.0], combined[:-1]))
+
+        if percentile is not None:
+            # Payouts stop after the first payout at which the combined probability falls below the target.
+            target_combined = 1 - percentile / 100.0
+            below = combined < target_combined
+            if below.any():
+                stop = below.argmax() + 1
+                alive = alive[:stop]
+                joint = joint[:stop]
+                combined = combined[:stop]
+                prev_combined = prev_combined[:stop]
+
+        if percentile is None:
+            payout_fraction = combined.copy()
+            if self.yield_curve.interest_rate == 'le' and stop > 0:
+                payout_fraction[0] = 0  # No credit for first payout.
+        else:
+            with errstate(divide = 'ignore', invalid = 'ignore'):
+                payout_fraction = where(combined >= target_combined, 1.0, (prev_combined - target_combined) / (prev_combined - combined))
+        payout_amount = payout_fraction * schedule[:stop]
+        payout_value = payout_amount / discount[:stop]
+
+        price = payout_value.sum()
+        duration = (y[:stop] * payout_value).sum()
+        annual_return = (payout_amount * r[:stop]).sum()
+        total_payout = payout_amount.sum()
+        if calcs:
+            calcs = Calcs(i = arange(stop), y = y[:stop], alive = alive, joint = joint, combined = combined, payout_fraction = payout_fraction,
+                interest_rate = r[:stop], fair_price = payout_value)
+        else:
+            calcs = None
+
+        if self.yield_curve.interest_rate == 'le' and percentile is None:
+            # Half credit after last payout, at the interest rate of the last payout.
+            last = max(0, stop - 1)
+            payout_fraction = 0.5
+            payout_amount = payout_fraction * float(schedule[stop])
+            payout_value = payout_amount / float(discount[last])
+            price += payout_value
+            duration += float(y[stop]) * payout_value
+            annual_return += payout_amount * float(r[last])
+            total_payout += payout_amount
+            if calcs != None:
+                calcs.append(i = stop, y = float(y[stop]), alive = 0.0, joint = 0.0, combined = 0.0, payout_fraction = payout_fraction,
+                    interest_rate = float(r[last]), fair_price = payout_value)
+
+        return float(price), float(duration), float(annual_return), float(total_payout), calcs
+
+    def price_percentiles(self, percentiles, survival = None):
+        # Prices through each of a list of percentile life expectancies, with None for the expected value.
+        # Shares the survival curve, discounting, and schedule between the percentiles, only redoing the final summation.
+        # The percentile of the scenario itself is ignored.
+
+        grid = self.payout_grid(survival)
+        return [self.results(self.payouts_from_grid(grid, percentile))[0] for percentile in percentiles]
+
+# Required parameters of a price_batch() row.
+price_batch_required = ('interest_rate', 'date', 'table', 'sex', 'age')  # Date is the yield curve date.
+
+# Optional parameters of a price_batch() row, and their default values.
+price_batch_defaults = {
+    'adjust': 0,
+    'ae': 'aer2005_08-summary',
+    'le_set': None,
+    'sex2': None,  # No secondary annuitant if None.
+    'age2': None,  # Required if sex2 is specified.
+    'le_set2': None,
+    'payout_delay': 0,  # Months.
+    'tax': 0,
+    'joint_payout_fraction': 1,
+    'joint_contingent': True,
+    'period_certain': 0,
+    'frequency': 12,
+    'mwr': 1,
+    'cpi_adjust': 'calendar',
+    'percentile': None,
+}
+
+# Rows sharing these parameters share a yield curve, life tables, and survival curve.
+price_batch_group_params = ('interest_rate', 'date', 'adjust', 'table', 'sex', 'age', 'ae', 'le_set', 'sex2', 'age2', 'le_set2', 'frequency', 'joint_contingent')
+
+def price_batch_group(group):
+    # Price a list of (row number, row parameters) all sharing the same price_batch_group_params.
+    # Exceptions are returned by name since the process pool is unable to pickle nested exception classes.
+
+    try:
+        first = group[0][1]
+        yield_curve = get_yield_curve(first['interest_rate'], first['date'], adjust = first['adjust'])
+        life_table = LifeTable(first['table'], first['sex'], first['age'], ae = first['ae'], le_set = first['le_set'], date_str = first['date'])
+        if first['sex2'] == None:
+            life_table2 = None
+        else:
+            life_table2 = LifeTable(first['table'], first['sex2'], first['age2'], ae = first['ae'], le_set = first['le_set2'], date_str = first['date'])
+        survival = None
+        results = []
+        for n, row in group:
+            scenario = Scenario(yield_curve, row['payout_delay'], None, None, row['tax'], life_table, life_table2 = life_table2, \
+                joint_payout_fraction = row['joint_payout_fraction'], joint_contingent = row['joint_contingent'], period_certain = row['period_certain'], \
+                frequency = row['frequency'], mwr = row['mwr'], cpi_adjust = row['cpi_adjust'], percentile = row['percentile'])
+            if survival == None:
+                survival = scenario.survival(scenario.start_time())
+            price = scenario.price(survival = survival)
+            results.append((n, price, scenario.duration, scenario.annual_return))
+        return results
+    except YieldCurve.NoData:
+        return 'NoData'
+    except LifeTable.UnableToAdjust:
+        return 'UnableToAdjust'
+
+def price_batch(rows, processes = None):
+    # Price a table of scenarios, such as a quote sheet. Each row is a dict of parameters; see price_batch_required and price_batch_defaults.
+    # Returns arrays of the price, duration, and annual return of each row.
+    # Groups of rows with the same life tables and yield curve are priced in parallel using processes processes, or one per cpu if None.
+
+    groups = OrderedDict()
+    for n, row in enumerate(rows):
+        unknown = set(row.keys()) - set(price_batch_required) - set(price_batch_defaults.keys())
+        assert not unknown, 'Unknown price_batch parameters: ' + ', '.join(sorted(unknown))
+        missing = set(price_batch_required) - set(row.keys())
+        assert not missing, 'Missing price_batch parameters: ' + ', '.join(sorted(missing))
+        row = dict(price_batch_defaults, **row)
+        assert row['sex2'] == None or row['age2'] != None, 'Missing price_batch parameter: age2'
+        key = tuple(row[param] for param in price_batch_group_params)
+        groups.setdefault(key, []).append((n, row))
+    groups = groups.values()
+
+    if processes == 1 or len(groups) <= 1:
+        group_results = map(price_batch_group, groups)
+    else:
+        pool = Pool(processes)
         try:
-            price /= self.frequency * (1 - self.tax) * self.mwr
-        except ZeroDivisionError:
-            price = float('inf')
-        self.calcs = calcs
-        return price
+            group_results = pool.map(price_batch_group, groups)
+        finally:
+            pool.close()
+            pool.join()
+
+    prices = empty(len(rows))
+    durations = empty(len(rows))
+    annual_returns = empty(len(rows))
+    for results in group_results:
+        if results == 'NoData':
+            raise YieldCurve.NoData
+        elif results == 'UnableToAdjust':
+            raise LifeTable.UnableToAdjust
+        for n, price, duration, annual_return in results:
+            prices[n] = price
+            durations[n] = duration
+            annual_returns[n] = annual_return
+
+    return prices, durations, annual_returns
 
 # MWR decreases 2% at age 50 and 5% at age 90 when cross from one age nearest birthday to the next.
 
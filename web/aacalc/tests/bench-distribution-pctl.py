@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+# Microbenchmark of lognormal distribution percentile calculation: scipy.stats versus Alloc.distribution_pctl() and Alloc.distribution_pctls().
+
+import sys
+
+from math import exp, isnan, log, sqrt
+from timeit import default_timer
+
+from numpy import array, linspace
+from scipy.stats import lognorm
+
+path = '/home/ubuntu/aacalc/web'
+if path not in sys.path:
+    sys.path.append(path)
+
+from aacalc.alloc import Alloc, compute_alloc, loss_pctl_fat_tail
+
+def scipy_distribution_pctl(pctl, mean, vol):
+    # Prior implementation of Alloc.distribution_pctl().
+    try:
+        mu = log(mean ** 2 / sqrt(vol ** 2 + mean ** 2))
+    except ZeroDivisionError:
+        return mean
+    sigma = sqrt(log(vol ** 2 / mean ** 2 + 1))
+    value = lognorm.ppf(pctl, sigma, scale=exp(mu))
+    value = float(value) # De-numpyfy.
+    if isnan(value):
+        return mean
+    return value
+
+def timed(f, repeat):
+    start = default_timer()
+    for _ in xrange(repeat):
+        result = f()
+    return (default_timer() - start) / repeat, result
+
+alloc = Alloc()
+means = tuple(float(mean) for mean in linspace(0.95, 1.1, 1000))
+vols = tuple(float(vol) for vol in linspace(0, 0.25, 1000))
+means_array = array(means)
+vols_array = array(vols)
+
+scipy_time, scipy_values = timed(lambda: [scipy_distribution_pctl(loss_pctl_fat_tail, mean, vol) for mean, vol in zip(means, vols)], 3)
+scalar_time, scalar_values = timed(lambda: [alloc.distribution_pctl(loss_pctl_fat_tail, mean, vol) for mean, vol in zip(means, vols)], 3)
+array_time, array_values = timed(lambda: alloc.distribution_pctls(loss_pctl_fat_tail, means_array, vols_array), 3)
+
+assert scalar_values == scipy_values
+assert list(array_values) == scipy_values
+
+print 'percentiles', len(means)
+print 'scipy.stats %.2f us' % (scipy_time / len(means) * 1e6)
+print 'scalar %.2f us (%.0fx)' % (scalar_time / len(means) * 1e6, scipy_time / scalar_time)
+print 'array %.3f us (%.0fx)' % (array_time / len(means) * 1e6, scipy_time / array_time)
+
+compute_alloc({'date': '2015-12-31'}) # Load market data.
+compute_time, _ = timed(lambda: compute_alloc({'date': '2015-12-31'}), 10)
+print 'compute_alloc %.0f ms' % (compute_time * 1e3)
@@ -1,6 +1,5 @@
 #!/usr/bin/python
 
-import os
 import sys
 
 from math import isnan
@@ -9,13 +8,7 @@ path = '/home/ubuntu/aacalc/web'
 if path not in sys.path:
     sys.path.append(path)
 
-path = '/home/ubuntu/aacalc/web/project'
-if path not in sys.path:
-    sys.path.append(path)
-
-os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
-
-from aacalc.views.alloc import Alloc
+from aacalc.alloc import Alloc
 
 def db(who, age, amount):
     return {
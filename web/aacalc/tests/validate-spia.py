@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# Validate the SPIA pricing engine against its reference implementations:
+#     The numpy and python pricing engines agree, using the parity engine, over a fixed set of scenarios.
+#     price_batch(), both in parallel and in a single process, agrees with pricing each scenario serially.
+#     The compiled Treasury store returns the same yield curve data as scanning the CSV files.
+#     Life tables calibrated to a life expectancy using calibrate_q_adjust() have that life expectancy under the python engine.
+
+import sys
+
+path = '/home/ubuntu/aacalc/web'
+if path not in sys.path:
+    sys.path.append(path)
+
+from aacalc.spia import LifeTable, Scenario, YieldCurve, get_yield_curve, price_batch, price_batch_defaults
+
+date_str = '2015-12-31'
+
+scenarios = (
+    ('default', {}),
+    ('female', {'sex': 'female'}),
+    ('age=40', {'age': 40}),
+    ('age=90', {'age': 90}),
+    ('age=65.5', {'age': 65.5}),
+    ('ssa-cohort', {'table': 'ssa-cohort'}),
+    ('ssa-period', {'table': 'ssa-period'}),
+    ('ae=none', {'ae': 'none'}),
+    ('ae=full', {'ae': 'aer2005_08-full'}),
+    ('nominal', {'interest_rate': 'nominal'}),
+    ('fixed=2%', {'interest_rate': 'fixed', 'adjust': 0.02}),
+    ('real+1%', {'adjust': 0.01}),
+    ('delay=10y', {'payout_delay': 120}),
+    ('delay=10y, age=90', {'age': 90, 'payout_delay': 120}),
+    ('tax=30%, mwr=90%', {'tax': 0.3, 'mwr': 0.9}),
+    ('period_certain=10y', {'period_certain': 10}),
+    ('period_certain=40y', {'period_certain': 40}),
+    ('frequency=1', {'frequency': 1}),
+    ('frequency=4, nominal', {'frequency': 4, 'interest_rate': 'nominal'}),
+    ('cpi_adjust=all', {'cpi_adjust': 'all'}),
+    ('cpi_adjust=payout, delay=5.5m', {'cpi_adjust': 'payout', 'payout_delay': 5.5}),
+    ('percentile=95', {'percentile': 95}),
+    ('percentile=50, frequency=1', {'percentile': 50, 'frequency': 1}),
+    ('le_set=25', {'le_set': 25}),
+    ('le_set=15, ssa-cohort', {'le_set': 15, 'table': 'ssa-cohort'}),
+    ('joint contingent 70%', {'sex2': 'female', 'age2': 62, 'joint_payout_fraction': 0.7}),
+    ('joint survivor 50%', {'sex2': 'female', 'age2': 62, 'joint_payout_fraction': 0.5, 'joint_contingent': False}),
+    ('joint, le_set2=30', {'sex2': 'female', 'age2': 62, 'le_set2': 30}),
+    ('joint, period_certain=10y, delay=5y', {'sex2': 'male', 'age2': 70, 'period_certain': 10, 'payout_delay': 60}),
+    ('joint, percentile=90, ssa-period', {'sex2': 'female', 'age2': 60, 'percentile': 90, 'table': 'ssa-period'}),
+    ('fixed=0%, le_set=20, frequency=1', {'interest_rate': 'fixed', 'le_set': 20, 'frequency': 1}),
+)
+
+rows = tuple(dict({'interest_rate': 'real', 'date': date_str, 'table': 'iam2012-basic', 'sex': 'male', 'age': 65}, **params) for desc, params in scenarios)
+
+tolerance = 1e-9
+
+def close(a, b):
+    return abs(a - b) <= tolerance * max(abs(a), abs(b), 1)
+
+def price_serial(row):
+    # Price a price_batch() row on its own, without sharing anything between rows, using the parity engine.
+
+    row = dict(price_batch_defaults, **row)
+    yield_curve = get_yield_curve(row['interest_rate'], row['date'], adjust = row['adjust'])
+    life_table = LifeTable(row['table'], row['sex'], row['age'], ae = row['ae'], le_set = row['le_set'], date_str = row['date'])
+    if row['sex2'] == None:
+        life_table2 = None
+    else:
+        life_table2 = LifeTable(row['table'], row['sex2'], row['age2'], ae = row['ae'], le_set = row['le_set2'], date_str = row['date'])
+    scenario = Scenario(yield_curve, row['payout_delay'], None, None, row['tax'], life_table, life_table2 = life_table2, \
+        joint_payout_fraction = row['joint_payout_fraction'], joint_contingent = row['joint_contingent'], period_certain = row['period_certain'], \
+        frequency = row['frequency'], mwr = row['mwr'], cpi_adjust = row['cpi_adjust'], percentile = row['percentile'])
+    price = scenario.price(engine = 'parity', calcs = True)
+
+    return price, scenario.duration, scenario.annual_return
+
+failures = 0
+
+print 'parity'
+serial = []
+for (desc, params), row in zip(scenarios, rows):
+    try:
+        result = price_serial(row)
+    except AssertionError as e:
+        failures += 1
+        result = (float('nan'), ) * 3
+        print '    FAIL', desc, e
+    serial.append(result)
+    print "{price:>10.4f} {duration:>8.4f} {annual_return:>8.4%} {desc}".format(price = result[0], duration = result[1], annual_return = result[2], desc = desc)
+
+for processes in (None, 1):
+    print 'price_batch processes=%s' % processes
+    mismatches = 0
+    prices, durations, annual_returns = price_batch(rows, processes = processes)
+    for (desc, params), expected, batch in zip(scenarios, serial, zip(prices, durations, annual_returns)):
+        if not all(close(a, b) for a, b in zip(expected, batch)):
+            mismatches += 1
+            print '    FAIL', desc, expected, tuple(batch)
+    failures += mismatches
+    print '%d/%d agree' % (len(rows) - mismatches, len(rows))
+
+print 'treasury store'
+mismatches = 0
+checked = 0
+for interest_rate in ('real', 'nominal'):
+    yield_curve = YieldCurve(interest_rate, date_str)
+    for date, date_low in (('2015-12-31', None), ('2016-01-01', None), ('2015-01-01', None), ('2015-07-04', None), ('2010-06-15', None), \
+        ('2005-01-03', None), ('1990-01-01', None), ('2015-12-31', '2015-12-01'), ('2015-06-30', '2014-07-01')):
+        results = []
+        for get_treasury in (yield_curve.get_treasury, yield_curve.get_treasury_csv):
+            try:
+                years, rates, yield_curve_date = get_treasury(date, date_low)
+                # The CSV scan returns the quotes of a date range most recent year first; they are only ever averaged.
+                results.append((sorted(zip(years, rates)), yield_curve_date))
+            except YieldCurve.NoData:
+                results.append('NoData')
+        checked += 1
+        if results[0] != results[1]:
+            mismatches += 1
+            print '    FAIL', interest_rate, date, date_low
+failures += mismatches
+print '%d/%d agree' % (checked - mismatches, checked)
+
+print 'calibrate_q_adjust'
+le_yield_curve = get_yield_curve('le', date_str)
+for table, sex, age, le_set in (('iam2012-basic', 'male', 65, 25), ('iam2012-basic', 'female', 50, 40), ('ssa-cohort', 'male', 65, 15), \
+    ('ssa-period', 'female', 80, 12), ('iam2012-basic', 'male', 90, 3)):
+    life_table = LifeTable(table, sex, age, ae = 'aer2005_08-summary', le_set = le_set, date_str = date_str)
+    le = Scenario(le_yield_curve, 0, None, None, 0, life_table).price(engine = 'python')
+    ok = abs(le / le_set - 1) < 1e-4  # Tolerance used by calibrate_q_adjust().
+    if not ok:
+        failures += 1
+    print "{status:>4} {le:>7.4f} {le_set:>3} {table} {sex} {age}".format(status = 'ok' if ok else 'FAIL', le = le, le_set = le_set, table = table, sex = sex, age = age)
+
+print 'failures', failures
+sys.exit(1 if failures else 0)
@@ -20,7 +20,8 @@ from re import DOTALL, match
 from django.http import HttpResponse
 from django.test.client import RequestFactory
 
-from aacalc.views.alloc import Alloc, alloc
+from aacalc.alloc import Alloc
+from aacalc.views.alloc import alloc
 from aacalc.views.le import le
 from aacalc.views.spia import default_spia_params, spia
 from aacalc.views.utils import default_params, run_response
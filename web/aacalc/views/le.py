@@ -18,25 +18,55 @@ from datetime import datetime
 from decimal import Decimal
 from django.shortcuts import render
 
-from aacalc.forms import LeForm
-from aacalc.spia import LifeTable, Scenario, YieldCurve
+from numpy import load
 
-le_percentiles = (None, 80, 90, 95, 98, 99, )
+from aacalc.forms import LeForm
+from aacalc.le import compute_le, le_percentiles, le_table_age_difference, le_table_max_age, le_table_path, le_table_sexes, le_table_tables
 
 le_labels = ('80th', '90th', '95th', '98th', '99th', )
 
-def get_le(table, date_str, sex, age, sex2, age2):
-
-    yield_curve = YieldCurve('le', date_str)
-    life_table = LifeTable(table, sex, age, ae = 'aer2005_08-summary')
+le_table_cache = {}  # Loaded tables by date. Only the most recent is retained.
+
+def get_le_table(date_str):
+
+    try:
+        return le_table_cache[date_str]
+    except KeyError:
+        pass
+    try:
+        with open(le_table_path(date_str), 'rb') as f:
+            npz = load(f)
+            le_table = {'singles': npz['singles'], 'couples': npz['couples']}
+    except IOError:
+        return None
+    le_table_cache.clear()
+    le_table_cache[date_str] = le_table
+    return le_table
+
+def lookup_le(table, date_str, sex, age, sex2, age2):
+    # Life expectancies from the precomputed table, or None if not present.
+
+    if table not in le_table_tables or age != int(age) or not 0 <= age <= le_table_max_age:
+        return None
+    if sex2 != None and (age2 != int(age2) or not 0 <= age2 <= le_table_max_age or abs(age2 - age) > le_table_age_difference):
+        return None
+    le_table = get_le_table(date_str)
+    if le_table == None:
+        return None
+    t = le_table_tables.index(table)
+    s = le_table_sexes.index(sex)
     if sex2 == None:
-        life_table2 = None
+        le = le_table['singles'][t, s, int(age)]
     else:
-        life_table2 = LifeTable(table, sex2, age2, ae = 'aer2005_08-summary')
-    le = []
-    for percentile in le_percentiles:
-        scenario = Scenario(yield_curve, 0, None, None, 0, life_table, life_table2 = life_table2, frequency = 12, percentile = percentile)
-        le.append("%.2f" % (scenario.price(), ))
+        le = le_table['couples'][t, s, le_table_sexes.index(sex2), int(age), int(age2 - age) + le_table_age_difference]
+
+    return ["%.2f" % (l / 100.0, ) for l in le.tolist()]
+
+def get_le(table, date_str, sex, age, sex2, age2):
+
+    le = lookup_le(table, date_str, sex, age, sex2, age2)
+    if le == None:
+        le = ["%.2f" % (l, ) for l in compute_le(table, date_str, sex, age, sex2, age2)]
 
     return le
 
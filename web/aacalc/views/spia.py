@@ -15,15 +15,24 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from calendar import monthrange
+from collections import OrderedDict
+from csv import writer
 from datetime import date, datetime, timedelta
 from decimal import Decimal
-from math import isnan
+from itertools import chain
+from json import dumps, loads
+from logging import getLogger
+from math import isinf, isnan
 
 from django.forms.utils import ErrorList
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render
 
 from aacalc.forms import SpiaForm
-from aacalc.spia import LifeTable, Scenario, YieldCurve
+from aacalc.spia import LifeTable, Scenario, YieldCurve, get_yield_curve
+
+spia_batch_max_quotes = 500
 
 def default_spia_params():
 
@@ -75,22 +84,7 @@ def first_payout(date_str, delay, frequency):
 
     return payout_date, payout_delay
 
-def format_calcs(calcs, price, payout, mwr):
-
-    calculations = []
-    for calc in calcs:
-        calculations.append({
-            'n': calc['i'],
-            'y': '{:.3f}'.format(calc['y']),
-            'primary': '{:.6f}'.format(calc['alive']),
-            'joint': '{:.6f}'.format(calc['joint']),
-            'combined': '{:.6f}'.format(calc['combined']),
-            'combined_price': '{:,.2f}'.format(calc['payout_fraction'] * payout),
-            'discount_rate': '{:.3f}%'.format((calc['interest_rate'] - 1) * 100),
-            'fair_price': '{:,.2f}'.format(calc['fair_price'] * payout),
-        })
-
-    fair_price = sum(calc['fair_price'] for calc in calcs) * payout
+def summarize_price(fair_price, price, mwr):
 
     try:
         actual_price = fair_price / mwr
@@ -98,7 +92,132 @@ def format_calcs(calcs, price, payout, mwr):
     except ZeroDivisionError:
         actual_price = float('inf')
 
-    return calculations, '{:,.2f}'.format(fair_price), '{:,.2f}'.format(actual_price)
+    return '{:,.2f}'.format(fair_price), '{:,.2f}'.format(actual_price)
+
+schedule_fields = ('n', 'years', 'primary', 'secondary', 'combined', 'combined_price', 'discount_rate_pct', 'fair_price')
+
+def schedule_rows(calcs, payout):
+    # Payout schedule rows in schedule_fields order, generated straight from the calcs arrays.
+
+    for row in zip(calcs.i.tolist(), calcs.y.tolist(), calcs.alive.tolist(), calcs.joint.tolist(), calcs.combined.tolist(), \
+        (calcs.payout_fraction * payout).tolist(), ((calcs.interest_rate - 1) * 100).tolist(), (calcs.fair_price * payout).tolist()):
+        yield row
+
+def get_life_table(life_tables, table, sex, age, ae, le_set, date_str):
+    # Share LifeTables, and hence their survival curves, between quotes using the life_tables dict.
+
+    if life_tables == None:
+        return LifeTable(table, sex, age, ae = ae, le_set = le_set, date_str = date_str)
+    key = (table, sex, age, ae, le_set, date_str)
+    try:
+        return life_tables[key]
+    except KeyError:
+        life_table = LifeTable(table, sex, age, ae = ae, le_set = le_set, date_str = date_str)
+        life_tables[key] = life_table
+        return life_table
+
+def quote_spia(data, calcs = True, life_tables = None):
+    # Price a validated SpiaForm. Set calcs to have the SPIA and self insure scenarios priced with calcs.
+    # Returns a dict of the quote values and priced scenarios.
+
+    interest_rate = data['bond_type']
+    date_str = data['date']
+    adjust = float(data['bond_adjust_pct']) / 100
+    yield_curve = get_yield_curve(interest_rate, date_str, adjust = adjust)
+
+    sex = data['sex']
+    age = float(data['age_years']);
+    if data['age_months']:
+        age += float(data['age_months']) / 12
+    ae = data['ae']
+
+    sex2 = data['sex2']
+
+    table = data['table']
+    le_set = None
+    le_set2 = None
+    if table == 'adjust':
+        table = 'ssa-cohort'
+        le_set = float(data['le_set'])
+        if sex2 != None:
+            le_set2 = float(data['le_set2'])
+
+    life_table = get_life_table(life_tables, table, sex, age, ae, le_set, date_str)
+
+    if sex2 == None:
+        life_table2 = None
+    else:
+        age2 = float(data['age2_years']);
+        if data['age2_months']:
+            age2 += float(data['age2_months']) / 12
+        life_table2 = get_life_table(life_tables, table, sex2, age2, ae, le_set2, date_str)
+
+    joint_payout_fraction = float(data['joint_payout_percent']) / 100
+    joint_contingent = (data['joint_type'] == 'contingent')
+    frequency = int(data['frequency'])
+    cpi_adjust = data['cpi_adjust']
+    payout_delay = float(data['payout_delay_months'])
+    if data['payout_delay_years']:
+        payout_delay += float(data['payout_delay_years']) * 12
+    payout_date, payout_delay = first_payout(date_str, payout_delay, frequency)
+    period_certain = data['period_certain']
+    premium = data.get('premium')
+    if premium != None:
+        premium = float(premium)
+    payout = data.get('payout')
+    if payout != None:
+        payout = float(payout)
+    mwr_percent = data.get('mwr_percent')
+    if mwr_percent == None:
+        mwr = 1
+    else:
+        mwr = float(mwr_percent) / 100
+    percentile = float(data['percentile'])
+
+    scenario = Scenario(yield_curve, payout_delay, premium, payout, 0, life_table, life_table2 = life_table2, \
+        joint_payout_fraction = joint_payout_fraction, joint_contingent = joint_contingent, period_certain = period_certain, \
+        frequency = frequency, cpi_adjust = cpi_adjust, mwr = mwr)
+    grid = scenario.payout_grid()  # Survival, discounting, and schedule shared by the SPIA and self insure scenarios.
+    price = scenario.price(calcs = calcs, grid = grid) * frequency
+
+    self_insure_scenario = Scenario(yield_curve, payout_delay, premium, payout, 0, life_table, life_table2 = life_table2, \
+        joint_payout_fraction = joint_payout_fraction, joint_contingent = joint_contingent, period_certain = period_certain, \
+        frequency = frequency, cpi_adjust = cpi_adjust, percentile = percentile)
+    self_insure_price = self_insure_scenario.price(calcs = calcs, grid = grid) * frequency
+
+    fair = (mwr == 1)
+    if premium == None:
+        solved = 'premium'
+        premium = payout * price
+    elif payout == None:
+        solved = 'payout'
+        try:
+            payout = premium / price
+        except ZeroDivisionError:
+            payout = float('inf')
+    else:
+        solved = 'mwr'
+        try:
+            mwr = payout * price / premium
+        except ZeroDivisionError:
+            mwr = float('inf')
+
+    return {
+        'solved': solved,  # Which of premium, payout, and mwr was computed.
+        'premium': premium,
+        'payout': payout,
+        'mwr': mwr,
+        'fair': fair,
+        'frequency': frequency,
+        'payout_date': payout_date,
+        'yield_curve_date': yield_curve.yield_curve_date,
+        'self_insure': payout * self_insure_price,
+        'fair_price': payout * scenario.payouts_from_grid(grid, scenario.percentile)[0],  # Actuarially fair price, before the MWR.
+        'self_insure_fair_price': payout * self_insure_scenario.payouts_from_grid(grid, self_insure_scenario.percentile)[0],
+        'self_insure_complex': (life_table2 != None and joint_payout_fraction != 1),
+        'scenario': scenario,
+        'self_insure_scenario': self_insure_scenario,
+    }
 
 def spia(request):
 
@@ -114,100 +233,31 @@ def spia(request):
 
             try:
 
-                data = spia_form.cleaned_data
-                interest_rate = data['bond_type']
-                date_str = data['date']
-                adjust = float(data['bond_adjust_pct']) / 100
-                yield_curve = YieldCurve(interest_rate, date_str, adjust = adjust)
-
-                sex = data['sex']
-                age = float(data['age_years']);
-                if data['age_months']:
-                    age += float(data['age_months']) / 12
-                ae = data['ae']
-
-                sex2 = data['sex2']
-
-                table = data['table']
-                le_set = None
-                le_set2 = None
-                if table == 'adjust':
-                    table = 'ssa-cohort'
-                    le_set = float(data['le_set'])
-                    if sex2 != None:
-                        le_set2 = float(data['le_set2'])
-
-                life_table = LifeTable(table, sex, age, ae = ae, le_set = le_set, date_str = date_str)
-
-                if sex2 == None:
-                    life_table2 = None
-                else:
-                    age2 = float(data['age2_years']);
-                    if data['age2_months']:
-                        age2 += float(data['age2_months']) / 12
-                    life_table2 = LifeTable(table, sex2, age2, ae = ae, le_set = le_set2, date_str = date_str)
-
-                joint_payout_fraction = float(data['joint_payout_percent']) / 100
-                joint_contingent = (data['joint_type'] == 'contingent')
-                frequency = int(data['frequency'])
-                cpi_adjust = data['cpi_adjust']
-                payout_delay = float(data['payout_delay_months'])
-                if data['payout_delay_years']:
-                    payout_delay += float(data['payout_delay_years']) * 12
-                payout_date, payout_delay = first_payout(date_str, payout_delay, frequency)
-                period_certain = data['period_certain']
-                premium = data.get('premium')
-                if premium != None:
-                    premium = float(premium)
-                payout = data.get('payout')
-                if payout != None:
-                    payout = float(payout)
-                mwr_percent = data.get('mwr_percent')
-                if mwr_percent == None:
-                    mwr = 1
-                else:
-                    mwr = float(mwr_percent) / 100
-                percentile = float(data['percentile'])
-
-                scenario = Scenario(yield_curve, payout_delay, premium, payout, 0, life_table, life_table2 = life_table2, \
-                    joint_payout_fraction = joint_payout_fraction, joint_contingent = joint_contingent, period_certain = period_certain, \
-                    frequency = frequency, cpi_adjust = cpi_adjust, mwr = mwr)
-                price = scenario.price() * frequency
-
-                self_insure_scenario = Scenario(yield_curve, payout_delay, premium, payout, 0, life_table, life_table2 = life_table2, \
-                    joint_payout_fraction = joint_payout_fraction, joint_contingent = joint_contingent, period_certain = period_certain, \
-                    frequency = frequency, cpi_adjust = cpi_adjust, percentile = percentile)
-                self_insure_price = self_insure_scenario.price() * frequency
-
-                results['fair'] = (mwr == 1)
+                quote = quote_spia(spia_form.cleaned_data, calcs = False)
+
+                results['fair'] = quote['fair']
                 results['frequency'] = {
                     12: 'monthly',
                     4: 'quarterly',
                     2: 'semi-annual',
                     1: 'annual',
-                }[frequency]
-                results['payout_date'] = payout_date
-                results['yield_curve_date'] = yield_curve.yield_curve_date
-                if premium == None:
-                    premium = payout * price
-                    results['premium'] = '{:,.0f}'.format(premium)
-                elif payout == None:
-                    try:
-                        payout = premium / price
-                    except ZeroDivisionError:
-                        payout = float('inf')
-                    results['payout'] = '{:,.2f}'.format(payout)
-                else:
-                    try:
-                        mwr = payout * price / premium
-                    except ZeroDivisionError:
-                        mwr = float('inf')
-                results['mwr_percent'] = '{:.1f}'.format(mwr * 100)
-                results['self_insure'] = '{:,.0f}'.format(payout * self_insure_price)
-                results['self_insure_complex'] = (life_table2 != None and joint_payout_fraction != 1)
-
-                results['spia_calcs'], results['spia_fair'], results['spia_actual'] = format_calcs(scenario.calcs, premium, payout, mwr)
-                results['bond_calcs'], results['bond_fair'], _ = format_calcs(self_insure_scenario.calcs, payout * self_insure_price, payout, 1)
+                }[quote['frequency']]
+                results['payout_date'] = quote['payout_date']
+                results['yield_curve_date'] = quote['yield_curve_date']
+                if quote['solved'] == 'premium':
+                    results['premium'] = '{:,.0f}'.format(quote['premium'])
+                elif quote['solved'] == 'payout':
+                    results['payout'] = '{:,.2f}'.format(quote['payout'])
+                results['mwr_percent'] = '{:.1f}'.format(quote['mwr'] * 100)
+                results['self_insure'] = '{:,.0f}'.format(quote['self_insure'])
+                results['self_insure_complex'] = quote['self_insure_complex']
+
+                results['spia_fair'], results['spia_actual'] = summarize_price(quote['fair_price'], quote['premium'], quote['mwr'])
+                results['bond_fair'], _ = summarize_price(quote['self_insure_fair_price'], quote['self_insure'], 1)
+
+                query = request.POST.copy()
+                query.pop('csrfmiddlewaretoken', None)
+                results['schedule_query'] = query.urlencode()
 
             except YieldCurve.NoData:
 
@@ -236,3 +286,96 @@ def spia(request):
         'spia_form': spia_form,
         'results': results,
     })
+
+class Echo:
+    # Pseudo file for csv.writer that returns each row instead of buffering it.
+
+    def write(self, value):
+        return value
+
+def spia_schedule(request, schedule, file_format):
+    # Stream the payout schedule of the SPIA or the self insure bonds for a quote specified by the SpiaForm fields in the query string.
+
+    spia_form = SpiaForm(request.GET)
+    if not spia_form.is_valid():
+        return HttpResponseBadRequest('Invalid quote: ' + dumps(spia_form.errors), content_type = 'text/plain')
+
+    try:
+        quote = quote_spia(spia_form.cleaned_data)
+    except YieldCurve.NoData:
+        return HttpResponseBadRequest('No interest rate data available for the specified date.', content_type = 'text/plain')
+    except LifeTable.UnableToAdjust:
+        return HttpResponseBadRequest('Unable to adjust life table to match additional life expectancy.', content_type = 'text/plain')
+
+    calcs = quote['scenario'].calcs if schedule == 'spia' else quote['self_insure_scenario'].calcs
+    rows = schedule_rows(calcs, quote['payout'])
+
+    if file_format == 'csv':
+        csv_writer = writer(Echo())
+        content = chain((csv_writer.writerow(schedule_fields), ), (csv_writer.writerow(row) for row in rows))
+        content_type = 'text/csv'
+    else:
+        content = chain(('[\n', ), (('' if n == 0 else ',\n') + dumps(OrderedDict(zip(schedule_fields, row))) for n, row in enumerate(rows)), ('\n]\n', ))
+        content_type = 'application/json'
+
+    response = StreamingHttpResponse(content, content_type = content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s-schedule.%s"' % (schedule, file_format)
+
+    return response
+
+def finite_or_none(value):
+    # JSON has no representation for infinities and NaNs.
+
+    return None if isinf(value) or isnan(value) else value
+
+@csrf_exempt
+def spia_batch(request):
+    # Price a JSON list of quotes, each specified using the SpiaForm fields. Returns a JSON list of results, or errors, one per quote.
+    # Quotes are priced in order of their yield curve and life tables, sharing the life tables and their survival curves between quotes.
+
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(('POST', ))
+    try:
+        quotes = loads(request.body)
+        assert(isinstance(quotes, list) and all(isinstance(quote, dict) for quote in quotes))
+    except (ValueError, AssertionError):
+        return HttpResponseBadRequest('Expecting a JSON list of quotes.', content_type = 'text/plain')
+    if len(quotes) > spia_batch_max_quotes:
+        return HttpResponseBadRequest('Too many quotes.', content_type = 'text/plain')
+
+    forms = tuple(SpiaForm(quote) for quote in quotes)
+    responses = [None] * len(forms)
+    valid = []
+    for n, spia_form in enumerate(forms):
+        if spia_form.is_valid():
+            valid.append(n)
+        else:
+            responses[n] = {'errors': spia_form.errors}
+
+    def group(n):
+        data = forms[n].cleaned_data
+        return (data['bond_type'], data['date'], data['bond_adjust_pct'], data['table'], data['sex'], data['age_years'], data['age_months'], \
+            data['sex2'], data['age2_years'], data['age2_months'], data['ae'], data['le_set'], data['le_set2'])
+
+    life_tables = {}
+    for n in sorted(valid, key = group):
+        try:
+            quote = quote_spia(forms[n].cleaned_data, calcs = False, life_tables = life_tables)
+            responses[n] = {
+                'premium': finite_or_none(quote['premium']),
+                'payout': finite_or_none(quote['payout']),
+                'mwr_percent': finite_or_none(quote['mwr'] * 100),
+                'self_insure': finite_or_none(quote['self_insure']),
+                'payout_date': quote['payout_date'],
+                'yield_curve_date': quote['yield_curve_date'],
+            }
+        except YieldCurve.NoData:
+            responses[n] = {'errors': {'date': ['No interest rate data available for the specified date.']}}
+        except LifeTable.UnableToAdjust:
+            responses[n] = {'errors': {'le': ['Unable to adjust life table to match additional life expectancy.']}}
+        except Exception:
+            # Don't discard the rest of the batch, but report the failure the same way as an unhandled request error.
+            getLogger('django.request').exception('Unable to price batch quote %d', n)
+            responses[n] = {'errors': {'__all__': ['Unable to price quote.']}}
+
+    return HttpResponse(dumps(responses, allow_nan = False), content_type = 'application/json')
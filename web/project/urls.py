@@ -28,6 +28,8 @@ urlpatterns = patterns('',
     url(r'^calculators/retire$', 'aacalc.views.alloc.alloc', {'mode': 'retire'}, name='start_retire'),
     url(r'^calculators/le$', 'aacalc.views.le.le', name='start_le'),
     url(r'^calculators/spia$', 'aacalc.views.spia.spia', name='start_spia'),
+    url(r'^calculators/spia/(spia|bonds)\.(csv|json)$', 'aacalc.views.spia.spia_schedule', name='spia_schedule'),
+    url(r'^calculators/spia/batch$', 'aacalc.views.spia.spia_batch', name='spia_batch'),
     url(r'^docs/?$', RedirectView.as_view(url=reverse_lazy('aacalc.views.about.about'), permanent=False)),
     url(r'^docs/(.*)$', 'aacalc.views.docs.docs', name='docs'),
     url(r'^file/(.*)$', 'aacalc.views.file.file', name='file'),